@@ -1,24 +1,99 @@
-import uproot
+import logging
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 from scipy.optimize import curve_fit
 from tqdm import tqdm
 
+from processed_io import read_columns, read_metadata
+from run_metrics import configure_logging
 from unit_conversion import cpd_to_gg, gg_to_mbqvolumem3
 
+logger = logging.getLogger(__name__)
+
+ACCIDENTAL_WINDOWS = 50
+
 def read_data(filename, tree_names):
-    data = {}
-    with uproot.open(filename) as file:
-        for tree_name in tree_names:
-            data[tree_name] = file[tree_name][tree_name].array(library="np")
-    df = pd.DataFrame(data)
+    # Per-file constants such as File_time are in df.attrs, not columns. copy=False keeps the
+    # memory-mapped cache columns as they are, one block each, instead of copying them in.
+    df = pd.DataFrame(read_columns(filename, tree_names), copy=False)
+    df.attrs.update(read_metadata(filename))
     return df
 
 def event_distance(x1, y1, z1, x2, y2, z2):
     return np.sqrt((x1 - x2)**2 + (y1 - y2)**2 + (z1 - z2)**2)
 
-def select_prompt_and_delay(df, prompt_E_min, prompt_E_max, delay_E_min, delay_E_max, FV_r_min, FV_r_max, FV_z_min, FV_z_max, dt_min, dt_max, dr_max):
+def find_coincidence_pairs(prompt_time, delay_time, dt_min, dt_max):
+    # Pair every prompt with the delays inside [dt_min, dt_max] via a binary search on the
+    # time-sorted delays, instead of the full prompt x delay cross join.
+    prompt_time = np.asarray(prompt_time)
+    delay_time = np.asarray(delay_time)
+    order = np.argsort(delay_time, kind='stable')
+    sorted_time = delay_time[order]
+    if np.issubdtype(prompt_time.dtype, np.integer) and np.issubdtype(delay_time.dtype, np.integer):
+        # int64 ns timestamps: the window bounds are exact integers.
+        lo = np.searchsorted(sorted_time, prompt_time + np.int64(np.ceil(dt_min)), side='left')
+        hi = np.searchsorted(sorted_time, prompt_time + np.int64(np.floor(dt_max)), side='right')
+    else:
+        # Widen the search window by a few ulps so rounding in prompt_time + dt never drops a pair;
+        # the exact dt cut is applied by the caller on the candidate pairs.
+        pad = 4 * np.spacing(np.abs(prompt_time).astype(np.float64) + max(abs(dt_min), abs(dt_max)))
+        lo = np.searchsorted(sorted_time, prompt_time + dt_min - pad, side='left')
+        hi = np.searchsorted(sorted_time, prompt_time + dt_max + pad, side='right')
+    counts = np.maximum(hi - lo, 0)
+
+    prompt_idx = np.repeat(np.arange(len(prompt_time)), counts)
+    first = np.repeat(lo - np.cumsum(counts) + counts, counts)
+    delay_idx = order[first + np.arange(len(prompt_idx))]
+
+    # Same pair order as the cross join: by prompt, then by delay position.
+    pair_order = np.lexsort((delay_idx, prompt_idx))
+    return prompt_idx[pair_order], delay_idx[pair_order]
+
+def off_time_windows(dt_max, n_windows=ACCIDENTAL_WINDOWS):
+    # Off-time windows start at 10 * dt_max, well past the Po-214 decay (half-life 164 us),
+    # and repeat every dt_max so they never overlap. Returns (first_offset, spacing, extent),
+    # extent being the largest prompt-delay time difference any window can reach.
+    first_offset = 10 * dt_max
+    spacing = dt_max
+    return first_offset, spacing, first_offset + n_windows * spacing
+
+def find_off_time_pairs(prompt_time, delay_time, dt_min, dt_max, n_windows, first_offset, spacing):
+    # One search over the span covering every window, then each pair is assigned to its window
+    # and kept if its window-relative dt is inside [dt_min, dt_max].
+    prompt_time = np.asarray(prompt_time)
+    delay_time = np.asarray(delay_time)
+    prompt_idx, delay_idx = find_coincidence_pairs(prompt_time, delay_time, first_offset + dt_min, first_offset + (n_windows - 1) * spacing + dt_max)
+    dt = delay_time[delay_idx] - prompt_time[prompt_idx] - first_offset
+    window = np.clip(np.floor((dt - dt_min) / spacing), 0, n_windows - 1).astype(np.int64)
+    dt_window = dt - window * spacing
+    keep = (dt_window >= dt_min) & (dt_window <= dt_max)
+    return prompt_idx[keep], delay_idx[keep], window[keep], dt_window[keep]
+
+def off_time_pair_mask(prompt_events, delay_events, prompt_idx, delay_idx, dr_max):
+    dr = event_distance(
+        prompt_events['recX'].to_numpy()[prompt_idx], prompt_events['recY'].to_numpy()[prompt_idx], prompt_events['recZ'].to_numpy()[prompt_idx],
+        delay_events['recX'].to_numpy()[delay_idx], delay_events['recY'].to_numpy()[delay_idx], delay_events['recZ'].to_numpy()[delay_idx]
+    )
+    return dr <= dr_max
+
+def estimate_accidentals(prompt_events, delay_events, dt_min, dt_max, dr_max, n_windows=ACCIDENTAL_WINDOWS):
+    first_offset, spacing, _ = off_time_windows(dt_max, n_windows)
+    prompt_idx, delay_idx, window, _ = find_off_time_pairs(prompt_events['rec_time'].to_numpy(), delay_events['rec_time'].to_numpy(), dt_min, dt_max, n_windows, first_offset, spacing)
+    keep = off_time_pair_mask(prompt_events, delay_events, prompt_idx, delay_idx, dr_max)
+    window_counts = np.bincount(window[keep], minlength=n_windows)
+    accidental_count, accidental_error = accidentals_from_windows(window_counts)
+    return accidental_count, accidental_error, window_counts
+
+def accidentals_from_windows(window_counts):
+    # Mean off-time pair count per window and its Poisson error.
+    n_windows = len(window_counts)
+    accidental_count = window_counts.sum() / n_windows
+    accidental_error = np.sqrt(window_counts.sum()) / n_windows
+    logger.info(f"偶然符合估计: {accidental_count} ± {accidental_error} ({n_windows} 个off-time窗口)")
+    return accidental_count, accidental_error
+
+def select_candidates(df, prompt_E_min, prompt_E_max, delay_E_min, delay_E_max, FV_r_min, FV_r_max, FV_z_min, FV_z_max):
     df['r'] = np.sqrt(df['recX']**2 + df['recY']**2)
     prompt_mask = (
         (df['Evis'] >= prompt_E_min) & (df['Evis'] <= prompt_E_max) &
@@ -26,7 +101,6 @@ def select_prompt_and_delay(df, prompt_E_min, prompt_E_max, delay_E_min, delay_E
         (df['recZ'] >= FV_z_min) & (df['recZ'] <= FV_z_max)
     )
     prompt_events = df[prompt_mask].copy()
-    print(prompt_events)
 
     delay_mask = (
         (df['Evis'] >= delay_E_min) & (df['Evis'] <= delay_E_max) &
@@ -34,54 +108,48 @@ def select_prompt_and_delay(df, prompt_E_min, prompt_E_max, delay_E_min, delay_E
         (df['recZ'] >= FV_z_min) & (df['recZ'] <= FV_z_max)
     )
     delay_events = df[delay_mask].copy()
-    print(delay_events)
-
-    # matched_prompt_events = []
-    # for i, prompt_event in tqdm(prompt_events.iterrows(), total=len(prompt_events), desc="Processing prompt events"):
-    #     for j, delay_event in delay_events.iloc[i+1:].iterrows():
-    #         dt = int(delay_event['rec_time']) - int(prompt_event['rec_time'])
-    #         if dt_min <= dt <= dt_max:
-    #             dr = event_distance(
-    #                 prompt_event['recX'], prompt_event['recY'], prompt_event['recZ'],
-    #                 delay_event['recX'], delay_event['recY'], delay_event['recZ']
-    #             )
-    #             if dr <= dr_max:
-    #                 prompt_event['dt'] = dt
-    #                 prompt_event['dr'] = dr
-    #                 matched_prompt_events.append(prompt_event)
-    #                 print(matched_prompt_events)
-
-    # matched_prompt_df = pd.DataFrame(matched_prompt_events)
-
-    # prompt_count = len(matched_prompt_df)
-    # print(f"满足条件的prompt信号个数: {prompt_count}")
-    # return matched_prompt_df, prompt_count
-    
-    prompt_events['key'] = 1
-    delay_events['key'] = 1
-    merged = pd.merge(prompt_events, delay_events, on='key', suffixes=('_prompt', '_delay')).drop('key', axis=1)
+    return prompt_events, delay_events
+
+def pair_frame(prompt_events, delay_events, prompt_idx, delay_idx):
+    prompt_pairs = prompt_events.iloc[prompt_idx].add_suffix('_prompt').reset_index(drop=True)
+    delay_pairs = delay_events.iloc[delay_idx].add_suffix('_delay').reset_index(drop=True)
+    merged = pd.concat([prompt_pairs, delay_pairs], axis=1)
+    merged.index = prompt_idx * len(delay_events) + delay_idx
     merged['dt'] = merged['rec_time_delay'] - merged['rec_time_prompt']
-    merged['dr'] = np.sqrt(
-        (merged['recX_prompt'] - merged['recX_delay'])**2 +
-        (merged['recY_prompt'] - merged['recY_delay'])**2 +
-        (merged['recZ_prompt'] - merged['recZ_delay'])**2
+    merged['dr'] = event_distance(
+        merged['recX_prompt'], merged['recY_prompt'], merged['recZ_prompt'],
+        merged['recX_delay'], merged['recY_delay'], merged['recZ_delay']
     )
+    return merged
+
+def pair_candidates(prompt_events, delay_events, dt_min, dt_max, dr_max):
+    prompt_idx, delay_idx = find_coincidence_pairs(prompt_events['rec_time'].to_numpy(), delay_events['rec_time'].to_numpy(), dt_min, dt_max)
+    merged = pair_frame(prompt_events, delay_events, prompt_idx, delay_idx)
     selected = merged[(merged['dt'] >= dt_min) & (merged['dt'] <= dt_max) & (merged['dr'] <= dr_max)]
-    print(selected)
+    return selected
+
+def select_prompt_and_delay(df, prompt_E_min, prompt_E_max, delay_E_min, delay_E_max, FV_r_min, FV_r_max, FV_z_min, FV_z_max, dt_min, dt_max, dr_max):
+    prompt_events, delay_events = select_candidates(df, prompt_E_min, prompt_E_max, delay_E_min, delay_E_max, FV_r_min, FV_r_max, FV_z_min, FV_z_max)
+    logger.debug("%s", prompt_events)
+    logger.debug("%s", delay_events)
+
+    selected = pair_candidates(prompt_events, delay_events, dt_min, dt_max, dr_max)
+    logger.debug("%s", selected)
     prompt_count = len(selected)
-    print(f"满足条件的prompt信号个数: {prompt_count}")
+    logger.info(f"满足条件的prompt信号个数: {prompt_count}")
     return selected, prompt_count
 
-def calculate_event_rate(df, prompt_count):
-    total_time = df['File_time'].max()
-    event_rate = prompt_count / total_time if total_time > 0 else 0
-    event_rate_error = np.sqrt(prompt_count) / total_time
-    print(f"事例率: {event_rate} 事件/单位时间 ± {event_rate_error}")
+def calculate_event_rate(df, prompt_count, accidental_count=0, accidental_error=0):
+    total_time = df.attrs['File_time']
+    event_rate = (prompt_count - accidental_count) / total_time if total_time > 0 else 0
+    event_rate_error = np.sqrt(prompt_count + accidental_error**2) / total_time
+    logger.info(f"事例率: {event_rate} 事件/单位时间 ± {event_rate_error}")
     return event_rate, event_rate_error
 
 def main():
+    configure_logging("INFO")
     filename = "/junofs/users/njulishuo/OSIRIS/Processed_data/08/OSIRISData_hybrid_20240801_092026_OSIRIS_run-5_2024081_091951_rs_processed.root"
-    tree_names = ["Evis", "recX", "recY", "recZ", "rec_time", "File_time"]
+    tree_names = ["Evis", "recX", "recY", "recZ", "rec_time"]
     df = read_data(filename, tree_names)
     num_bins = 500
     min_val = 0.38
@@ -98,7 +166,10 @@ def main():
 
     select_df, prompt_count = select_prompt_and_delay(df, prompt_E_min, prompt_E_max, delay_E_min, delay_E_max, FV_r_min, FV_r_max, FV_z_min, FV_z_max, dt_min, dt_max, dr_max)
 
-    event_rate, event_rate_error = calculate_event_rate(df, prompt_count)
+    prompt_events, delay_events = select_candidates(df, prompt_E_min, prompt_E_max, delay_E_min, delay_E_max, FV_r_min, FV_r_max, FV_z_min, FV_z_max)
+    accidental_count, accidental_error, _ = estimate_accidentals(prompt_events, delay_events, dt_min, dt_max, dr_max)
+
+    event_rate, event_rate_error = calculate_event_rate(df, prompt_count, accidental_count, accidental_error)
 
     event_rate_cpd = event_rate * 24 * 60 * 60
     event_rate_cpd_error = event_rate_error * 24 * 60 * 60
@@ -114,7 +185,7 @@ def main():
     event_mBq_20m3 = gg_to_mbqvolumem3(event_gg, half_life, molar_m, volume, rho)
     event_mBq_20m3_error = gg_to_mbqvolumem3(event_gg_error, half_life, molar_m, volume, rho)
 
-    print(f"事例率: {event_mBq_20m3} ± {event_mBq_20m3_error} mBq/20m3")
+    logger.info(f"事例率: {event_mBq_20m3} ± {event_mBq_20m3_error} mBq/20m3")
 
 if __name__ == "__main__":
     main()
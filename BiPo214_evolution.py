@@ -1,5 +1,5 @@
+import logging
 import os
-import uproot
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -7,10 +7,43 @@ from scipy.optimize import curve_fit
 from tqdm import tqdm
 from datetime import datetime
 import csv
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from BiPo214_cut import read_data, select_prompt_and_delay, event_distance, calculate_event_rate
+from BiPo214_cut import read_data, event_distance, calculate_event_rate, select_candidates, pair_candidates
+from BiPo214_cut import ACCIDENTAL_WINDOWS, accidentals_from_windows, find_off_time_pairs, off_time_pair_mask, off_time_windows
+from prefetch import PREFETCH_BYTES, PREFETCH_DEPTH, prefetch_map
+from processed_io import read_metadata
+from run_catalog import catalog_files
+from run_metrics import FileMetrics, configure_logging, summary_path, write_record, write_summary
+from column_cache import write_atomic
+from selection_cache import SelectionCache, cached_selection
 from unit_conversion import cpd_to_gg, gg_to_mbqvolumem3
 
+TREE_NAMES = ["Evis", "recX", "recY", "recZ", "rec_time"]
+# prompt_E_min, prompt_E_max, delay_E_min, delay_E_max, FV_r_min, FV_r_max, FV_z_min, FV_z_max, dt_min, dt_max, dr_max
+DEFAULT_CUTS = (0.3, 3.3, 0.75, 1.15, 0, 200, -200, 200, 1e3, 1.5e6, 150)
+
+logger = logging.getLogger(__name__)
+
+def file_start_time(filepath):
+    # Trigger time of the file's first event, from its metadata; files written before the
+    # metadata existed fall back to the timestamp in their name.
+    metadata = read_metadata(filepath) if os.path.exists(filepath) else {}
+    if "start_ns" in metadata:
+        return pd.Timestamp(int(metadata["start_ns"])).floor("s").to_pydatetime()
+    filename = os.path.basename(filepath)
+    time_str = filename.split("_")[2] + filename.split("_")[3]
+    return datetime.strptime(time_str, "%Y%m%d%H%M%S")
+
+def event_rate_to_mBq_20m3(event_rate):
+    half_life = 4.458e9  # 'year'
+    molar_m = 238.028910  # 'g/mol'
+    m_total = 16.202e6  # 'g'
+    volume = 20  # 'm^3'
+    rho = 860  # 'kg/m^3'
+    event_gg = cpd_to_gg(event_rate * 24 * 60 * 60, m_total, half_life, molar_m)
+    return gg_to_mbqvolumem3(event_gg, half_life, molar_m, volume, rho)
+
 def load_processed_files(csv_file):
     if not os.path.exists(csv_file):
         return set()
@@ -32,68 +65,330 @@ def log_error_file(txt_file, filename, error_message):
         f.write(f"Error processing file: {filename}\n")
         f.write(f"Error message: {error_message}\n\n")
 
-def process_files_in_folder(folder_path, csv_file, error_file):
+def finish_metrics(metrics_file, records):
+    if metrics_file is None or not records:
+        return
+    for record in records:
+        write_record(metrics_file, record)
+    summary = write_summary(summary_path(metrics_file), records)
+    logger.info(f"{summary['files']} files, {summary['events']} clusters, {summary['events_per_s']:.0f} clusters/s, stages: "
+                + ", ".join(f"{name} {seconds:.1f} s" for name, seconds in summary['stages'].items()))
+
+def process_files_in_folder(folder_path, csv_file, error_file, metrics_file=None, time_range=None, prefetch_depth=PREFETCH_DEPTH, prefetch_bytes=PREFETCH_BYTES):
     file_times = []
     event_rate_list, event_mBq_20m3_list = [], []
     event_rate_error_list, event_mBq_20m3_error_list = [], []
 
     processed_files = load_processed_files(csv_file)
+    selection_cache = SelectionCache()
+    records = []
 
-    root_files = [filename for filename in os.listdir(folder_path) if filename.endswith("rs_processed.root")]
-
-    for filename in tqdm(root_files, desc="Processing files", unit="file"):
+    filenames, unordered = sorted_processed_files(folder_path, time_range)
+    record_unordered(unordered, error_file, records)
+    root_files = []
+    for filename in filenames:
         if filename in processed_files:
-            print(f"Skipping already processed file: {filename}")
+            logger.debug(f"Skipping already processed file: {filename}")
             continue
+        root_files.append(filename)
+
+    # The next files are read in the background while the current one is processed; "read"
+    # is the time spent waiting for them.
+    prefetched = prefetch_map(lambda filename: read_data(os.path.join(folder_path, filename), TREE_NAMES), root_files, prefetch_depth, prefetch_bytes)
+    for filename, future in tqdm(prefetched, total=len(root_files), desc="Processing files", unit="file"):
         filepath = os.path.join(folder_path, filename)
+        metrics = FileMetrics(filename)
         try:
-            print(f"Processing file: {filename}")
+            logger.info(f"Processing file: {filename}")
 
-            tree_names = ["Evis", "recX", "recY", "recZ", "rec_time", "File_time"]
-            df = read_data(filepath, tree_names)
+            with metrics.stage("read"):
+                df = future.result()
+            metrics.add_column_bytes(df.memory_usage(index=False).sum())
+            metrics.add_events(len(df))
+            metrics.cut("clusters", len(df))
 
-            time_str = filename.split("_")[2] + filename.split("_")[3]
-            file_time = datetime.strptime(time_str, "%Y%m%d%H%M%S")
+            file_time = file_start_time(filepath)
             file_times.append(file_time)
 
-            prompt_E_min, prompt_E_max = 0.3, 3.3
-            delay_E_min, delay_E_max = 0.75, 1.15    
-            FV_r_min, FV_r_max = 0, 200
-            FV_z_min, FV_z_max = -200, 200
-            dt_min, dt_max = 1e3, 1.5e6
-            dr_max = 150
-
-            select_df, prompt_count = select_prompt_and_delay(df, prompt_E_min, prompt_E_max, delay_E_min, delay_E_max, FV_r_min, FV_r_max, FV_z_min, FV_z_max, dt_min, dt_max, dr_max)
-            event_rate, event_rate_error = calculate_event_rate(df, prompt_count)
-
-            event_rate_cpd = event_rate * 24 * 60 * 60
-            event_rate_cpd_error = event_rate_error * 24 * 60 * 60
-            half_life = 4.458e9  # 'year'
-            molar_m = 238.028910  # 'g/mol'
-            m_total = 16.202e6  # 'g'
-            volume = 20  # 'm^3'
-            rho = 860  # 'kg/m^3'
-
-            event_gg = cpd_to_gg(event_rate_cpd, m_total, half_life, molar_m)
-            event_gg_error = cpd_to_gg(event_rate_cpd_error, m_total, half_life, molar_m)
-
-            event_mBq_20m3 = gg_to_mbqvolumem3(event_gg, half_life, molar_m, volume, rho)
-            event_mBq_20m3_error = gg_to_mbqvolumem3(event_gg_error, half_life, molar_m, volume, rho)
+            with metrics.stage("coincidence"):
+                select_df, prompt_count, prompt_events, delay_events, window_counts = cached_selection(filepath, df, DEFAULT_CUTS, selection_cache)
+                accidental_count, accidental_error = accidentals_from_windows(window_counts)
+            metrics.cut("prompt_candidates", len(prompt_events))
+            metrics.cut("delay_candidates", len(delay_events))
+            metrics.cut("pairs", prompt_count)
+            event_rate, event_rate_error = calculate_event_rate(df, prompt_count, accidental_count, accidental_error)
+            event_mBq_20m3 = event_rate_to_mBq_20m3(event_rate)
+            event_mBq_20m3_error = event_rate_to_mBq_20m3(event_rate_error)
 
             event_mBq_20m3_list.append(event_mBq_20m3)
             event_mBq_20m3_error_list.append(event_mBq_20m3_error)
 
             save_to_csv(csv_file, filename, file_time, event_mBq_20m3, event_mBq_20m3_error)
+            records.append(metrics.record())
 
         except Exception as e:
             error_message = str(e)
-            log_error(error_file, filename, error_message)
-            print(f"Error processing file: {filename}, Error: {error_message}")
+            log_error_file(error_file, filename, error_message)
+            logger.error(f"Error processing file: {filename}, Error: {error_message}")
+            records.append(metrics.record(error_message))
             continue
 
+    logger.info(f"Selection cache: {selection_cache.stats()}")
+    finish_metrics(metrics_file, records)
     return file_times, event_mBq_20m3_list, event_mBq_20m3_error_list
 
-def plot_event_rate_evolution(file_times, event_rate_list, event_rate_error_list):
+def sorted_processed_files(folder_path, time_range=None):
+    # Files in start_ns order, and {filename: error} for those whose start time cannot be read.
+    # A (start, stop) time range is resolved through the folder's run catalog, which is already
+    # ordered by start_ns, instead of listing the folder.
+    if time_range is not None:
+        filenames = [os.path.basename(path) for path in catalog_files(folder_path, time_range)]
+        return [filename for filename in filenames if filename.endswith("rs_processed.root")], {}
+    start_times, unordered = {}, {}
+    for filename in os.listdir(folder_path):
+        if not filename.endswith("rs_processed.root"):
+            continue
+        try:
+            start_times[filename] = file_start_time(os.path.join(folder_path, filename))
+        except Exception as e:
+            unordered[filename] = f"cannot read the start time: {e}"
+    return sorted(start_times, key=start_times.get), unordered
+
+def record_unordered(unordered, error_file, records):
+    for filename, error_message in unordered.items():
+        logger.error(f"Error processing file: {filename}, Error: {error_message}")
+        if error_file is not None:
+            log_error_file(error_file, filename, error_message)
+        records.append(FileMetrics(filename).record(error_message))
+
+def file_time_range(filepath, df):
+    # [start_ns, stop_ns] trigger range from the metadata; older files take the start from their
+    # name and the length from File_time.
+    if "start_ns" in df.attrs and "stop_ns" in df.attrs:
+        return int(df.attrs["start_ns"]), int(df.attrs["stop_ns"])
+    start_ns = pd.Timestamp(file_start_time(filepath)).value
+    return start_ns, start_ns + int(df.attrs["File_time"] * 1e9)
+
+def split_live_time(start_ns, stop_ns, live_time, time_bin):
+    # The file's live time spread over the time bins its [start_ns, stop_ns] range overlaps, in
+    # proportion to the overlap.
+    step = pd.Timedelta(time_bin).value
+    first = pd.Timestamp(start_ns).floor(time_bin).value
+    if stop_ns <= start_ns:
+        return {pd.Timestamp(first): float(live_time)}
+    bin_starts = np.arange(first, stop_ns, step)
+    overlap = np.minimum(bin_starts + step, stop_ns) - np.maximum(bin_starts, start_ns)
+    return {pd.Timestamp(bin_start): float(live_time) * fraction for bin_start, fraction in zip(bin_starts, overlap / (stop_ns - start_ns)) if fraction > 0}
+
+def load_candidates(filepath, time_bin, cuts, metrics=None, df=None):
+    # df: the file's columns when they were already read. Returns the file's live time per time
+    # bin, and the prompts with the bin of their own time.
+    if metrics is None:
+        metrics = FileMetrics()
+    prompt_E_min, prompt_E_max, delay_E_min, delay_E_max, FV_r_min, FV_r_max, FV_z_min, FV_z_max = cuts[:8]
+    if df is None:
+        with metrics.stage("read"):
+            df = read_data(filepath, TREE_NAMES)
+    metrics.add_column_bytes(df.memory_usage(index=False).sum())
+    live_time = {}
+    offset = 0
+    if len(df):
+        start_ns, stop_ns = file_time_range(filepath, df)
+        live_time = split_live_time(start_ns, stop_ns, df.attrs['File_time'], time_bin)
+        # rec_time is not necessarily absolute: the file's first cluster is put at start_ns.
+        offset = start_ns - int(df['rec_time'].min())
+    with metrics.stage("candidates"):
+        prompt_events, delay_events = select_candidates(df, prompt_E_min, prompt_E_max, delay_E_min, delay_E_max, FV_r_min, FV_r_max, FV_z_min, FV_z_max)
+        prompt_events['time_bin'] = pd.to_datetime(prompt_events['rec_time'].to_numpy(np.int64) + offset).floor(time_bin).as_unit("ns")
+    return df, live_time, prompt_events, delay_events
+
+def tail_prompts(prompt_events, rec_time_max, cuts):
+    # Prompts close enough to the end of the file to pair with the next file, on time or in
+    # any of the off-time windows.
+    _, _, extent = off_time_windows(cuts[9])
+    return prompt_events[prompt_events['rec_time'] >= rec_time_max - extent]
+
+def add_counts(total, partial):
+    for bin_start, value in partial.items():
+        total[bin_start] = total.get(bin_start, 0) + value
+
+def record_candidates(metrics, df, prompt_events, delay_events):
+    metrics.add_events(len(df))
+    metrics.cut("clusters", len(df))
+    metrics.cut("prompt_candidates", len(prompt_events))
+    metrics.cut("delay_candidates", len(delay_events))
+
+def count_pairs(prompt_events, delay_events, tail, cuts, pair_count, off_count, filename="", metrics=None):
+    if metrics is None:
+        metrics = FileMetrics()
+    dt_min, dt_max, dr_max = cuts[8:]
+    if tail is not None and len(tail) and len(delay_events) and tail['rec_time'].max() > delay_events['rec_time'].min():
+        logger.warning(f"rec_time goes backwards at {filename}, dropping the carried-over prompts")
+        tail = None
+    if tail is not None:
+        prompt_events = pd.concat([tail, prompt_events], ignore_index=True)
+    with metrics.stage("coincidence"):
+        selected = pair_candidates(prompt_events, delay_events, dt_min, dt_max, dr_max)
+        add_counts(pair_count, selected['time_bin_prompt'].value_counts().to_dict())
+
+        first_offset, spacing, _ = off_time_windows(dt_max)
+        prompt_idx, delay_idx, _, _ = find_off_time_pairs(prompt_events['rec_time'].to_numpy(), delay_events['rec_time'].to_numpy(), dt_min, dt_max, ACCIDENTAL_WINDOWS, first_offset, spacing)
+        keep = off_time_pair_mask(prompt_events, delay_events, prompt_idx, delay_idx, dr_max)
+        add_counts(off_count, prompt_events['time_bin'].iloc[prompt_idx[keep]].value_counts().to_dict())
+    metrics.cut("pairs", len(selected))
+    metrics.cut("off_time_pairs", np.count_nonzero(keep))
+    return prompt_events
+
+def bin_counts_to_arrays(live_time, pair_count, off_count):
+    return {
+        "live_bins": np.array(list(live_time), dtype="datetime64[ns]"), "live_time": np.array(list(live_time.values()), dtype=np.float64),
+        "pair_bins": np.array(list(pair_count), dtype="datetime64[ns]"), "pair_count": np.array(list(pair_count.values()), dtype=np.int64),
+        "off_bins": np.array(list(off_count), dtype="datetime64[ns]"), "off_count": np.array(list(off_count.values()), dtype=np.int64),
+    }
+
+def bin_counts_from_arrays(arrays):
+    live_time = dict(zip(pd.to_datetime(arrays["live_bins"]), arrays["live_time"].tolist()))
+    pair_count = dict(zip(pd.to_datetime(arrays["pair_bins"]), arrays["pair_count"].tolist()))
+    off_count = dict(zip(pd.to_datetime(arrays["off_bins"]), arrays["off_count"].tolist()))
+    return live_time, pair_count, off_count
+
+def rates_per_bin(live_time, pair_count, off_count):
+    rows = []
+    for bin_start in sorted(live_time):
+        count = pair_count.get(bin_start, 0)
+        accidental_count = off_count.get(bin_start, 0) / ACCIDENTAL_WINDOWS
+        accidental_error = np.sqrt(off_count.get(bin_start, 0)) / ACCIDENTAL_WINDOWS
+        event_rate = (count - accidental_count) / live_time[bin_start] if live_time[bin_start] > 0 else 0
+        event_rate_error = np.sqrt(count + accidental_error**2) / live_time[bin_start] if live_time[bin_start] > 0 else 0
+        rows.append({
+            'time_bin': bin_start,
+            'live_time': live_time[bin_start],
+            'pair_count': count,
+            'accidental_count': accidental_count,
+            'accidental_error': accidental_error,
+            'event_rate': event_rate,
+            'event_rate_error': event_rate_error,
+            'event_mBq_20m3': event_rate_to_mBq_20m3(event_rate),
+            'event_mBq_20m3_error': event_rate_to_mBq_20m3(event_rate_error),
+        })
+    return pd.DataFrame(rows)
+
+def stream_coincidences(folder_path, cuts, time_bin="1h", metrics_file=None, time_range=None, prefetch_depth=PREFETCH_DEPTH, prefetch_bytes=PREFETCH_BYTES, error_file=None):
+    # Walk the files in time order and carry the prompt candidates from the last dt_max of
+    # each file into the next one, so Bi-Po pairs straddling a file boundary are kept.
+    # A pair is counted in the time bin of its prompt, and a file's live time is split over the
+    # bins it overlaps. A file that fails is logged and skipped, and no prompts are carried
+    # across it.
+    live_time = {}
+    pair_count = {}
+    off_count = {}
+    tail = None
+    records = []
+    root_files, unordered = sorted_processed_files(folder_path, time_range)
+    record_unordered(unordered, error_file, records)
+    prefetched = prefetch_map(lambda filename: read_data(os.path.join(folder_path, filename), TREE_NAMES), root_files, prefetch_depth, prefetch_bytes)
+    for filename, future in tqdm(prefetched, total=len(root_files), desc="Streaming files", unit="file"):
+        metrics = FileMetrics(filename)
+        try:
+            with metrics.stage("read"):
+                df = future.result()
+            df, file_live_time, prompt_events, delay_events = load_candidates(os.path.join(folder_path, filename), time_bin, cuts, metrics, df)
+            record_candidates(metrics, df, prompt_events, delay_events)
+            if len(df) == 0:
+                records.append(metrics.record())
+                continue
+            # Counted per file first, so a failure halfway leaves the totals untouched.
+            file_pair_count, file_off_count = {}, {}
+            prompt_events = count_pairs(prompt_events, delay_events, tail, cuts, file_pair_count, file_off_count, filename, metrics)
+            tail = tail_prompts(prompt_events, df['rec_time'].max(), cuts)
+        except Exception as e:
+            error_message = str(e)
+            logger.error(f"Error processing file: {filename}, Error: {error_message}")
+            if error_file is not None:
+                log_error_file(error_file, filename, error_message)
+            records.append(metrics.record(error_message))
+            tail = None
+            continue
+        add_counts(live_time, file_live_time)
+        add_counts(pair_count, file_pair_count)
+        add_counts(off_count, file_off_count)
+        records.append(metrics.record())
+    finish_metrics(metrics_file, records)
+    return rates_per_bin(live_time, pair_count, off_count)
+
+def coincidence_task(task):
+    # One file per task. The previous file's tail prompts are re-read here (cheap with the
+    # column cache), so boundary pairs are found without any ordering between tasks.
+    filepath, previous_filepath, time_bin, cuts = task
+    metrics = FileMetrics(os.path.basename(filepath))
+    try:
+        cache = SelectionCache()
+        with metrics.stage("cache"):
+            key = cache.key([path for path in (previous_filepath, filepath) if path is not None], cuts, "prompt_time_bins", time_bin, ACCIDENTAL_WINDOWS)
+            cached = cache.get(key)
+        if cached is not None:
+            live_time, pair_count, off_count = bin_counts_from_arrays(cached)
+            metrics.cut("pairs", sum(pair_count.values()))
+            return filepath, live_time, pair_count, off_count, None, metrics.record()
+
+        pair_count = {}
+        off_count = {}
+        tail = None
+        tail_failed = False
+        if previous_filepath is not None:
+            # An unreadable previous file only loses the pairs across the boundary.
+            try:
+                with metrics.stage("read"):
+                    previous_df, _, previous_prompts, _ = load_candidates(previous_filepath, time_bin, cuts)
+                if len(previous_df):
+                    tail = tail_prompts(previous_prompts, previous_df['rec_time'].max(), cuts)
+            except Exception as e:
+                logger.warning(f"Cannot read the tail of {previous_filepath}, pairing {filepath} without it: {e}")
+                tail_failed = True
+        df, live_time, prompt_events, delay_events = load_candidates(filepath, time_bin, cuts, metrics)
+        record_candidates(metrics, df, prompt_events, delay_events)
+        if len(df):
+            count_pairs(prompt_events, delay_events, tail, cuts, pair_count, off_count, os.path.basename(filepath), metrics)
+        if not tail_failed:
+            cache.put(key, **bin_counts_to_arrays(live_time, pair_count, off_count))
+        return filepath, live_time, pair_count, off_count, None, metrics.record()
+    except Exception as e:
+        return filepath, {}, {}, {}, str(e), metrics.record(str(e))
+
+def write_csv_atomic(df, csv_file):
+    write_atomic(csv_file, lambda f: df.to_csv(f, index=False))
+
+def parallel_coincidences(folder_path, cuts, time_bin="1h", workers=None, csv_file=None, error_file=None, metrics_file=None, time_range=None):
+    filenames, unordered = sorted_processed_files(folder_path, time_range)
+    root_files = [os.path.join(folder_path, filename) for filename in filenames]
+    tasks = [(filepath, previous, time_bin, cuts) for previous, filepath in zip([None] + root_files[:-1], root_files)]
+
+    live_time = {}
+    pair_count = {}
+    off_count = {}
+    records = []
+    record_unordered(unordered, error_file, records)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(coincidence_task, task) for task in tasks]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing files", unit="file"):
+            filepath, file_live_time, file_pair_count, file_off_count, error_message, record = future.result()
+            records.append(record)
+            if error_message is not None:
+                logger.error(f"Error processing file: {filepath}, Error: {error_message}")
+                if error_file is not None:
+                    log_error_file(error_file, os.path.basename(filepath), error_message)
+                continue
+            add_counts(live_time, file_live_time)
+            add_counts(pair_count, file_pair_count)
+            add_counts(off_count, file_off_count)
+
+    finish_metrics(metrics_file, records)
+    rates = rates_per_bin(live_time, pair_count, off_count)
+    if csv_file is not None:
+        write_csv_atomic(rates, csv_file)
+    return rates
+
+def plot_event_rate_evolution(file_times, event_rate_list, event_rate_error_list, save_path=None):
     plt.figure(figsize=(10, 6))
     plt.errorbar(file_times, event_rate_list, yerr=event_rate_error_list, fmt='o', label="U238 Event Rate", ecolor='red', capsize=3)
     plt.xlabel("Time")
@@ -102,14 +397,35 @@ def plot_event_rate_evolution(file_times, event_rate_list, event_rate_error_list
     plt.xticks(rotation=45)
     plt.tight_layout()
     plt.legend()
-    plt.show()
+    if save_path is None:
+        plt.show()
+        return
+    plt.savefig(save_path)
+    plt.close()
 
 def main():
     folder_path = "/junofs/users/njulishuo/OSIRIS/Processed_data/08/"
     csv_file = "/junofs/users/njulishuo/OSIRIS/ana/U238ana/processed_files.csv"
     error_file = "/junofs/users/njulishuo/OSIRIS/ana/U238ana/error_log.txt" 
-    file_times, event_mBq_20m3_list, event_mBq_20m3_error_list = process_files_in_folder(folder_path, csv_file, error_file)
-    print(file_times, event_mBq_20m3_list, event_mBq_20m3_error_list)
+    rates_csv = "/junofs/users/njulishuo/OSIRIS/ana/U238ana/event_rate_per_bin.csv"
+    metrics_file = "/junofs/users/njulishuo/OSIRIS/ana/U238ana/metrics.jsonl"
+    mode = "per_file"  # "per_file", "streaming" or "parallel"
+    log_level = "INFO"  # "DEBUG" also prints the selected candidates and pairs
+    time_range = None  # e.g. ("2024-08-01", "2024-08-02"), looked up in the folder's run catalog
+    configure_logging(log_level)
+
+    if mode == "streaming":
+        rates = stream_coincidences(folder_path, DEFAULT_CUTS, time_bin="1h", metrics_file=metrics_file, time_range=time_range, error_file=error_file)
+        write_csv_atomic(rates, rates_csv)
+        logger.info("%s", rates)
+        return
+    if mode == "parallel":
+        rates = parallel_coincidences(folder_path, DEFAULT_CUTS, time_bin="1h", csv_file=rates_csv, error_file=error_file, metrics_file=metrics_file, time_range=time_range)
+        logger.info("%s", rates)
+        return
+
+    file_times, event_mBq_20m3_list, event_mBq_20m3_error_list = process_files_in_folder(folder_path, csv_file, error_file, metrics_file, time_range)
+    logger.debug("%s %s %s", file_times, event_mBq_20m3_list, event_mBq_20m3_error_list)
     # plot_event_rate_evolution(file_times, event_rate_list, event_rate_error_list)
 
 if __name__ == "__main__":
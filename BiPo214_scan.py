@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+from BiPo214_cut import ACCIDENTAL_WINDOWS, read_data, find_coincidence_pairs, find_off_time_pairs, off_time_windows, pair_frame, select_candidates
+
+CUT_NAMES = ["prompt_E_min", "prompt_E_max", "delay_E_min", "delay_E_max", "FV_r_min", "FV_r_max", "FV_z_min", "FV_z_max", "dt_min", "dt_max", "dr_max"]
+
+# Pair quantity each cut acts on, and whether it is a lower ("min") or upper ("max") bound.
+# The fiducial volume applies to both events, so it is the pair's extreme r/z that matters.
+SCAN_AXES = {
+    "prompt_E_min": ("Evis_prompt", "min"),
+    "prompt_E_max": ("Evis_prompt", "max"),
+    "delay_E_min": ("Evis_delay", "min"),
+    "delay_E_max": ("Evis_delay", "max"),
+    "FV_r_min": ("r_min", "min"),
+    "FV_r_max": ("r_max", "max"),
+    "FV_z_min": ("z_min", "min"),
+    "FV_z_max": ("z_max", "max"),
+    "dt_min": ("dt", "min"),
+    "dt_max": ("dt", "max"),
+    "dr_max": ("dr", "max"),
+}
+
+def pair_table(prompt_events, delay_events, prompt_idx, delay_idx, dt=None):
+    pairs = pair_frame(prompt_events, delay_events, prompt_idx, delay_idx)
+    return pd.DataFrame({
+        "dt": pairs["dt"].to_numpy() if dt is None else dt,
+        "dr": pairs["dr"].to_numpy(),
+        "Evis_prompt": pairs["Evis_prompt"].to_numpy(),
+        "Evis_delay": pairs["Evis_delay"].to_numpy(),
+        "r_prompt": pairs["r_prompt"].to_numpy(),
+        "r_delay": pairs["r_delay"].to_numpy(),
+        "z_prompt": pairs["recZ_prompt"].to_numpy(),
+        "z_delay": pairs["recZ_delay"].to_numpy(),
+    })
+
+def build_pair_tables(df, loose_cuts, n_off_windows, first_offset, off_time_spacing):
+    # Pair once with the loosest cuts: the on-time pairs, and in a single sweep the pairs found in
+    # the n_off_windows windows shifted by first_offset + k * off_time_spacing, which estimate the
+    # accidental background. Off-time pairs carry their window-relative dt.
+    prompt_E_min, prompt_E_max, delay_E_min, delay_E_max, FV_r_min, FV_r_max, FV_z_min, FV_z_max, dt_min, dt_max, dr_max = loose_cuts
+    prompt_events, delay_events = select_candidates(df, prompt_E_min, prompt_E_max, delay_E_min, delay_E_max, FV_r_min, FV_r_max, FV_z_min, FV_z_max)
+    prompt_time = prompt_events["rec_time"].to_numpy()
+    delay_time = delay_events["rec_time"].to_numpy()
+
+    prompt_idx, delay_idx = find_coincidence_pairs(prompt_time, delay_time, dt_min, dt_max)
+    on_table = pair_table(prompt_events, delay_events, prompt_idx, delay_idx)
+    on_table = on_table[(on_table["dt"] >= dt_min) & (on_table["dt"] <= dt_max) & (on_table["dr"] <= dr_max)].reset_index(drop=True)
+    if not n_off_windows:
+        return on_table, on_table.iloc[:0]
+    prompt_idx, delay_idx, _, dt_window = find_off_time_pairs(prompt_time, delay_time, dt_min, dt_max, n_off_windows, first_offset, off_time_spacing)
+    off_table = pair_table(prompt_events, delay_events, prompt_idx, delay_idx, dt_window)
+    return on_table, off_table[off_table["dr"] <= dr_max].reset_index(drop=True)
+
+def axis_values(table, quantity):
+    if quantity in ("r_min", "r_max", "z_min", "z_max"):
+        name, bound = quantity.split("_")
+        values = [table[f"{name}_prompt"].to_numpy(), table[f"{name}_delay"].to_numpy()]
+        return np.minimum(*values) if bound == "min" else np.maximum(*values)
+    return table[quantity].to_numpy()
+
+def grid_counts(table, axes):
+    # Histogram every pair into the slot of the tightest threshold it still passes on each axis,
+    # then turn the histogram into pass counts with one cumulative sum per axis.
+    shape = tuple(len(thresholds) + 1 for _, thresholds, _ in axes)
+    slots = []
+    for quantity, thresholds, kind in axes:
+        values = axis_values(table, quantity)
+        side = "left" if kind == "max" else "right"
+        slots.append(np.searchsorted(thresholds, values, side=side))
+    if slots:
+        flat = np.ravel_multi_index(slots, shape)
+        counts = np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+    else:
+        counts = np.array(len(table))
+    for axis, (_, _, kind) in enumerate(axes):
+        if kind == "max":
+            counts = np.cumsum(counts, axis=axis).take(np.arange(shape[axis] - 1), axis=axis)
+        else:
+            counts = np.flip(np.cumsum(np.flip(counts, axis=axis), axis=axis), axis=axis).take(np.arange(1, shape[axis]), axis=axis)
+    return counts
+
+def scan_cuts(on_table, off_table, n_off_windows, loose_cuts, grid):
+    loose = dict(zip(CUT_NAMES, loose_cuts))
+    axes = []
+    names = []
+    orders = []
+    for name, values in grid.items():
+        if name not in SCAN_AXES:
+            raise KeyError(f"Unknown cut {name}, expected one of {CUT_NAMES}")
+        quantity, kind = SCAN_AXES[name]
+        values = np.asarray(values, dtype=np.float64)
+        if (kind == "max" and np.any(values > loose[name])) or (kind == "min" and np.any(values < loose[name])):
+            raise ValueError(f"Scan values for {name} must be at least as tight as the loose cut {loose[name]}")
+        order = np.argsort(values, kind="stable")
+        axes.append((quantity, values[order], kind))
+        names.append(name)
+        orders.append(order)
+
+    # Back to the caller's grid order.
+    unsort = np.ix_(*[np.argsort(order) for order in orders]) if orders else ()
+    n_on = grid_counts(on_table, axes)[unsort]
+    n_off = grid_counts(off_table, axes)[unsort]
+
+    mesh = np.meshgrid(*[np.asarray(grid[name], dtype=np.float64) for name in names], indexing="ij")
+    result = pd.DataFrame({name: values.ravel() for name, values in zip(names, mesh)})
+    result["n_on"] = np.ravel(n_on)
+    result["n_accidental"] = np.ravel(n_off) / n_off_windows if n_off_windows else 0.0
+    result["n_accidental_error"] = np.sqrt(np.ravel(n_off)) / n_off_windows if n_off_windows else 0.0
+    result["signal"] = result["n_on"] - result["n_accidental"]
+    result["signal_error"] = np.sqrt(result["n_on"] + result["n_accidental_error"]**2)
+    signal_error = result["signal_error"].to_numpy()
+    result["fom"] = np.divide(result["signal"].to_numpy(), signal_error, out=np.zeros(len(result)), where=signal_error > 0)
+    return result
+
+def cut_scan(df, loose_cuts, grid, n_off_windows=ACCIDENTAL_WINDOWS):
+    # The off-time windows of estimate_accidentals for the loose dt_max, so at the loose cuts
+    # n_accidental is what calculate_event_rate subtracts; tighter cuts reuse the same windows.
+    first_offset, off_time_spacing, _ = off_time_windows(loose_cuts[9], n_off_windows)
+    on_table, off_table = build_pair_tables(df, loose_cuts, n_off_windows, first_offset, off_time_spacing)
+    return scan_cuts(on_table, off_table, n_off_windows, loose_cuts, grid)
+
+def main():
+    filename = "/junofs/users/njulishuo/OSIRIS/Processed_data/08/OSIRISData_hybrid_20240801_092026_OSIRIS_run-5_2024081_091951_rs_processed.root"
+    tree_names = ["Evis", "recX", "recY", "recZ", "rec_time"]
+    df = read_data(filename, tree_names)
+
+    loose_cuts = (0.3, 3.3, 0.6, 1.3, 0, 250, -250, 250, 1e3, 3e6, 300)
+    grid = {
+        "dt_max": np.linspace(0.5e6, 3e6, 11),
+        "dr_max": np.linspace(50, 300, 11),
+        "delay_E_min": [0.6, 0.65, 0.7, 0.75, 0.8],
+        "FV_r_max": [150, 175, 200, 225, 250],
+    }
+    result = cut_scan(df, loose_cuts, grid)
+    print(result.sort_values("fom", ascending=False).head(20))
+
+if __name__ == "__main__":
+    main()
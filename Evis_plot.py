@@ -1,26 +1,135 @@
-import uproot
+import os
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from column_cache import open_entry, write_atomic
+from processed_io import read_column, read_metadata
+from Read_Event_njulishuo import CHARGE_PER_MEV
+from run_catalog import processed_file_info
+
+FILL_CHUNK = 1000000
 
 def read_data(filename, tree_name):
-    with uproot.open(filename) as file:
-        tree = file[tree_name]
-        data = tree[tree_name].array(library="np")
+    data = read_column(filename, tree_name)
     return data
 
+class HistogramAccumulator:
+    def __init__(self, num_bins=500, x_min=0.0, x_max=3.0, counts=None):
+        self.num_bins = num_bins
+        self.x_min = x_min
+        self.x_max = x_max
+        self.counts = np.zeros(num_bins, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+
+    @property
+    def bin_edges(self):
+        return np.histogram_bin_edges([], bins=self.num_bins, range=(self.x_min, self.x_max))
+
+    @property
+    def bin_centers(self):
+        bin_edges = self.bin_edges
+        return (bin_edges[:-1] + bin_edges[1:]) / 2
+
+    def fill(self, values):
+        for start in range(0, len(values), FILL_CHUNK):
+            hist, _ = np.histogram(values[start:start + FILL_CHUNK], bins=self.num_bins, range=(self.x_min, self.x_max))
+            self.counts += hist
+        return self
+
+    def merge(self, other):
+        if (self.num_bins, self.x_min, self.x_max) != (other.num_bins, other.x_min, other.x_max):
+            raise ValueError(f"Cannot merge histograms with different binning: {(self.num_bins, self.x_min, self.x_max)} vs {(other.num_bins, other.x_min, other.x_max)}")
+        self.counts += other.counts
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __add__(self, other):
+        return HistogramAccumulator(self.num_bins, self.x_min, self.x_max, self.counts.copy()).merge(other)
+
+    def save(self, file):
+        # A path or a binary file handle.
+        np.savez(file, counts=self.counts, binning=np.array([self.num_bins, self.x_min, self.x_max]))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            num_bins, x_min, x_max = data["binning"]
+            return cls(int(num_bins), float(x_min), float(x_max), data["counts"])
+
+def file_histogram(filename, num_bins=500, x_min=0.0, x_max=3.0):
+    # Per-file histograms are cached next to the file's cached columns, so they are rebuilt
+    # only when the processed file changes.
+    cache_path = os.path.join(open_entry(filename), f"Evis_hist_{num_bins}_{x_min}_{x_max}.npz")
+    if os.path.exists(cache_path):
+        return HistogramAccumulator.load(cache_path)
+    accumulator = HistogramAccumulator(num_bins, x_min, x_max).fill(read_data(filename, "Evis"))
+    write_atomic(cache_path, accumulator.save)
+    return accumulator
+
+def histogram_files(filenames, num_bins=500, x_min=0.0, x_max=3.0, workers=1):
+    total = HistogramAccumulator(num_bins, x_min, x_max)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(file_histogram, filename, num_bins, x_min, x_max) for filename in filenames]
+            for future in as_completed(futures):
+                total += future.result()
+    else:
+        for filename in filenames:
+            total += file_histogram(filename, num_bins, x_min, x_max)
+    return total
+
 def fit_function(x, a, mean, sigma, c0, c1):
     gauss = a * np.exp(-0.5 * ((x - mean) / sigma) ** 2)
     polynomial = c0 + c1 * x
     return gauss + polynomial
 
+def fit_jacobian(x, a, mean, sigma, c0, c1):
+    gauss = np.exp(-0.5 * ((x - mean) / sigma) ** 2)
+    return np.column_stack([
+        gauss,
+        a * gauss * (x - mean) / sigma**2,
+        a * gauss * (x - mean) ** 2 / sigma**3,
+        np.ones_like(x),
+        x,
+    ])
+
+def initial_guess(bin_centers, hist):
+    # Line through the window's end bins, then the largest excess above it as the peak.
+    c1 = (hist[-1] - hist[0]) / (bin_centers[-1] - bin_centers[0])
+    c0 = hist[0] - c1 * bin_centers[0]
+    excess = hist - (c0 + c1 * bin_centers)
+    peak = np.argmax(excess)
+    bin_width = bin_centers[1] - bin_centers[0]
+    sigma = max(np.count_nonzero(excess > excess[peak] / 2) * bin_width / 2.355, bin_width)
+    return [excess[peak], bin_centers[peak], sigma, c0, c1]
+
+def fit_peak(accumulator, min_val, max_val, p0=None):
+    bin_centers = accumulator.bin_centers
+    mask = (bin_centers >= min_val) & (bin_centers <= max_val)
+    x = bin_centers[mask]
+    hist = accumulator.counts[mask].astype(np.float64)
+    if p0 is None:
+        p0 = initial_guess(x, hist)
+    popt, pcov = curve_fit(fit_function, x, hist, p0=p0, jac=fit_jacobian)
+    return popt, np.sqrt(np.diag(pcov))
+
 def plot_and_fit(evis_data, num_bins, min_val, max_val, x_min, x_max, save_path):
     if evis_data.size == 0:
         print("Error: No data to plot.")
         return None, None, None
+    return plot_and_fit_histogram(HistogramAccumulator(num_bins, x_min, x_max).fill(evis_data), min_val, max_val, save_path)
 
-    hist, bin_edges = np.histogram(evis_data, bins=num_bins, range=(x_min, x_max))
-    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+def plot_and_fit_histogram(accumulator, min_val, max_val, save_path):
+    if accumulator.counts.sum() == 0:
+        print("Error: No data to plot.")
+        return None, None, None
+
+    hist = accumulator.counts
+    bin_centers = accumulator.bin_centers
 
     mask = (bin_centers >= min_val) & (bin_centers <= max_val)
     fit_bin_centers = bin_centers[mask]
@@ -52,6 +161,80 @@ def plot_and_fit(evis_data, num_bins, min_val, max_val, x_min, x_max, save_path)
 
     return popt, gauss, polynomial
 
+def calibration_info(filename):
+    # Time range and the charge/MeV the file was converted with, from its metadata. Files
+    # converted before the metadata existed fall back to their rec_time range and CHARGE_PER_MEV.
+    metadata = read_metadata(filename)
+    if "start_ns" not in metadata:
+        metadata.update(processed_file_info(filename))
+    return {"filename": filename, "start_ns": metadata.get("start_ns"), "stop_ns": metadata.get("stop_ns"), "charge_per_mev": metadata.get("charge_per_mev", CHARGE_PER_MEV)}
+
+def calibration_units(filenames, time_bin=None):
+    # One unit per file, or the files merged per time bin, ordered in time. A unit is
+    # (filenames, start_ns, stop_ns, mean charge/MeV the files were converted with).
+    infos = [calibration_info(filename) for filename in filenames]
+    infos = sorted((info for info in infos if info["start_ns"] is not None), key=lambda info: info["start_ns"])
+    if time_bin is None:
+        return [([info["filename"]], info["start_ns"], info["stop_ns"], info["charge_per_mev"]) for info in infos]
+    units = {}
+    for info in infos:
+        bin_start = pd.Timestamp(info["start_ns"]).floor(time_bin).value
+        units.setdefault(bin_start, []).append(info)
+    return [([info["filename"] for info in unit], min(info["start_ns"] for info in unit), max(info["stop_ns"] for info in unit),
+             float(np.mean([info["charge_per_mev"] for info in unit]))) for unit in units.values()]
+
+def fit_units(task):
+    # Fits a run of consecutive units, each warm-started from its predecessor's result; a unit
+    # whose warm start fails is retried from its own initial guess.
+    units, num_bins, x_min, x_max, min_val, max_val = task
+    rows = []
+    p0 = None
+    for filenames, start_ns, stop_ns, charge_per_mev in units:
+        accumulator = HistogramAccumulator(num_bins, x_min, x_max)
+        for filename in filenames:
+            accumulator += file_histogram(filename, num_bins, x_min, x_max)
+        row = {"start_ns": start_ns, "stop_ns": stop_ns, "files": len(filenames), "first_file": os.path.basename(filenames[0]), "entries": int(accumulator.counts.sum()),
+               "converted_charge_per_mev": charge_per_mev}
+        popt = None
+        for guess in ([p0, None] if p0 is not None else [None]):
+            try:
+                popt, perr = fit_peak(accumulator, min_val, max_val, guess)
+                break
+            except (RuntimeError, ValueError):
+                continue
+        if popt is None:
+            row.update(status="failed")
+        else:
+            row.update(zip(["a", "mean", "sigma", "c0", "c1"], popt), mean_error=perr[1], sigma_error=perr[2], status="ok")
+            p0 = popt
+        rows.append(row)
+    return rows
+
+def calibrate_files(filenames, min_val=0.38, max_val=0.65, num_bins=500, x_min=0.0, x_max=3.0, workers=1, time_bin=None, peak_energy=None):
+    # Fits the Evis peak per file or time bin, without plotting. charge_per_mev rescales the
+    # charge/MeV each file was converted with so the peak sits at peak_energy (default: the median
+    # fitted peak, i.e. the drift relative to the whole period); recalibrating files converted
+    # with a table gives that table back.
+    units = calibration_units(filenames, time_bin)
+    bounds = np.linspace(0, len(units), min(workers, len(units)) + 1).astype(int)
+    tasks = [(units[start:stop], num_bins, x_min, x_max, min_val, max_val) for start, stop in zip(bounds[:-1], bounds[1:])]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rows = [row for rows in executor.map(fit_units, tasks) for row in rows]
+    else:
+        rows = [row for task in tasks for row in fit_units(task)]
+
+    table = pd.DataFrame(rows, columns=["start_ns", "stop_ns", "files", "first_file", "entries", "converted_charge_per_mev", "a", "mean", "sigma", "c0", "c1", "mean_error",
+                                        "sigma_error", "status"])
+    ok = table["status"] == "ok"
+    if peak_energy is None:
+        peak_energy = table.loc[ok, "mean"].median()
+    table["charge_per_mev"] = np.where(ok, table["converted_charge_per_mev"] * table["mean"] / peak_energy, np.nan)
+    return table
+
+def save_calibration(table, path):
+    write_atomic(path, lambda f: table.to_csv(f, index=False))
+
 def main():
     filename = "/junofs/users/njulishuo/OSIRIS/Processed_data/data_20240811/OSIRISData_hybrid_20240811_161147_OSIRIS_run-5_20240811_161029_rs_processed.root"
     num_bins = 500
@@ -60,9 +243,20 @@ def main():
     x_min = 0.0
     x_max = 3.0
     save_path = "/junofs/users/njulishuo/OSIRIS/Figure/Evis/Evis_fit.pdf"
+    mode = "plot"  # "plot" or "calibrate"
+
+    if mode == "calibrate":
+        folder_path = "/junofs/users/njulishuo/OSIRIS/Processed_data/08/"
+        calibration_path = "/junofs/users/njulishuo/OSIRIS/Processed_data/08/Evis_calibration.csv"
+        filenames = sorted(os.path.join(folder_path, name) for name in os.listdir(folder_path) if name.endswith("_processed.root"))
+        table = calibrate_files(filenames, min_val, max_val, num_bins, x_min, x_max, workers=os.cpu_count())
+        save_calibration(table, calibration_path)
+        print(table[["first_file", "mean", "mean_error", "charge_per_mev", "status"]])
+        return
 
-    evis = read_data(filename, "Evis")
-    plot_and_fit(evis, num_bins, min_val, max_val, x_min, x_max, save_path)
+    filenames = [filename]
+    accumulator = histogram_files(filenames, num_bins, x_min, x_max)
+    plot_and_fit_histogram(accumulator, min_val, max_val, save_path)
 
 if __name__ == "__main__":
     main()
@@ -1,11 +1,14 @@
-import uproot
 import numpy as np
 import matplotlib.pyplot as plt
 
+from processed_io import read_columns, read_column
+
+FILL_CHUNK = 1000000
+# Map extents are rounded out to this many mm.
+EXTENT_STEP = 100.0
+
 def read_data(filename, tree_name):
-    with uproot.open(filename) as file:
-        tree = file[tree_name]
-        data = tree[tree_name].array(library="np")
+    data = read_column(filename, tree_name)
     return data
 
 def plot_heatmap(x, y, z, evis, output_file_prefix):
@@ -31,9 +34,117 @@ def plot_heatmap(x, y, z, evis, output_file_prefix):
     plt.savefig(f'{output_file_prefix}_rz.pdf')
     plt.show()
 
+class DensityAccumulator:
+    # Vertex maps binned in mm: counts and summed Evis per bin for the X-Y and R-Z views.
+    # Vertices beyond the ranges are counted in xy_outside/rz_outside.
+    def __init__(self, xy_range, r_range, z_range, num_bins=200):
+        self.num_bins = num_bins
+        self.xy_edges = np.linspace(xy_range[0], xy_range[1], num_bins + 1)
+        self.r_edges = np.linspace(r_range[0], r_range[1], num_bins + 1)
+        self.z_edges = np.linspace(z_range[0], z_range[1], num_bins + 1)
+        self.xy_counts = np.zeros((num_bins, num_bins), dtype=np.int64)
+        self.xy_evis = np.zeros((num_bins, num_bins))
+        self.rz_counts = np.zeros((num_bins, num_bins), dtype=np.int64)
+        self.rz_evis = np.zeros((num_bins, num_bins))
+        self.xy_outside = 0
+        self.rz_outside = 0
+
+    def fill(self, x, y, z, evis):
+        for start in range(0, len(x), FILL_CHUNK):
+            chunk = slice(start, start + FILL_CHUNK)
+            x_mm = np.asarray(x[chunk], dtype=np.float64) * 10
+            y_mm = np.asarray(y[chunk], dtype=np.float64) * 10
+            z_mm = np.asarray(z[chunk], dtype=np.float64) * 10
+            r_mm = np.sqrt(x_mm**2 + y_mm**2)
+            weights = np.asarray(evis[chunk], dtype=np.float64)
+            bins = (self.xy_edges, self.xy_edges)
+            counts = np.histogram2d(x_mm, y_mm, bins=bins)[0].astype(np.int64)
+            self.xy_counts += counts
+            self.xy_outside += len(x_mm) - int(counts.sum())
+            self.xy_evis += np.histogram2d(x_mm, y_mm, bins=bins, weights=weights)[0]
+            bins = (self.r_edges, self.z_edges)
+            counts = np.histogram2d(r_mm, z_mm, bins=bins)[0].astype(np.int64)
+            self.rz_counts += counts
+            self.rz_outside += len(r_mm) - int(counts.sum())
+            self.rz_evis += np.histogram2d(r_mm, z_mm, bins=bins, weights=weights)[0]
+        return self
+
+    def merge(self, other):
+        for name in ("xy_edges", "r_edges", "z_edges"):
+            if not np.array_equal(getattr(self, name), getattr(other, name)):
+                raise ValueError(f"Cannot merge density maps with different {name}")
+        self.xy_counts += other.xy_counts
+        self.xy_evis += other.xy_evis
+        self.rz_counts += other.rz_counts
+        self.rz_evis += other.rz_evis
+        self.xy_outside += other.xy_outside
+        self.rz_outside += other.rz_outside
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    @staticmethod
+    def mean(evis_sum, counts):
+        return np.ma.masked_where(counts == 0, evis_sum / np.maximum(counts, 1))
+
+def data_extent(filenames):
+    # xy_range, r_range and z_range in mm covering every vertex of the files.
+    r_max = z_max = 0.0
+    for filename in filenames:
+        data = read_columns(filename, ["recX", "recY", "recZ"])
+        for start in range(0, len(data["recX"]), FILL_CHUNK):
+            chunk = slice(start, start + FILL_CHUNK)
+            r = np.hypot(np.asarray(data["recX"][chunk], dtype=np.float64), np.asarray(data["recY"][chunk], dtype=np.float64))
+            z = np.abs(np.asarray(data["recZ"][chunk], dtype=np.float64))
+            if len(r):
+                r_max = max(r_max, np.nanmax(r) * 10)
+                z_max = max(z_max, np.nanmax(z) * 10)
+    r_max = float(max(np.ceil(r_max / EXTENT_STEP), 1) * EXTENT_STEP)
+    z_max = float(max(np.ceil(z_max / EXTENT_STEP), 1) * EXTENT_STEP)
+    return {"xy_range": (-r_max, r_max), "r_range": (0.0, r_max), "z_range": (-z_max, z_max)}
+
+def density_files(filenames, num_bins=200, **ranges):
+    # ranges: xy_range, r_range and z_range in mm, see DensityAccumulator; by default the
+    # extent of the data, read from the cached columns in a first pass.
+    ranges = {**data_extent(filenames), **ranges} if len(ranges) < 3 else ranges
+    accumulator = DensityAccumulator(num_bins=num_bins, **ranges)
+    for filename in filenames:
+        data = read_columns(filename, ["recX", "recY", "recZ", "Evis"])
+        accumulator.fill(data["recX"], data["recY"], data["recZ"], data["Evis"])
+    if accumulator.xy_outside or accumulator.rz_outside:
+        print(f"Warning: {accumulator.xy_outside} vertices outside the X-Y map, {accumulator.rz_outside} outside the R-Z map")
+    return accumulator
+
+def plot_density(accumulator, output_file_prefix, value="mean_evis"):
+    views = [
+        ("xy", accumulator.xy_edges, accumulator.xy_edges, accumulator.xy_counts, accumulator.xy_evis, 'X(mm)', 'Y(mm)', 'X-Y Plane'),
+        ("rz", accumulator.r_edges, accumulator.z_edges, accumulator.rz_counts, accumulator.rz_evis, 'R(mm)', 'Z(mm)', 'R-Z Plane'),
+    ]
+    for suffix, x_edges, y_edges, counts, evis_sum, xlabel, ylabel, plane in views:
+        plt.figure(figsize=(8, 6))
+        if value == "counts":
+            image, label = np.ma.masked_where(counts == 0, counts), 'Counts'
+        else:
+            image, label = accumulator.mean(evis_sum, counts), 'Mean Evis'
+        plt.pcolormesh(x_edges, y_edges, image.T, cmap='viridis', rasterized=True)
+        plt.colorbar(label=label)
+        plt.xlabel(xlabel, size = '20')
+        plt.ylabel(ylabel, size = '20')
+        plt.title(f'Density Map of {plane}', size = '20')
+        plt.savefig(f'{output_file_prefix}_{suffix}.pdf')
+        plt.show()
+
 def main():
     filename = "/junofs/users/njulishuo/OSIRIS/Processed_data/data_20240811/OSIRISData_hybrid_20240811_161147_OSIRIS_run-5_20240811_161029_rs_processed.root"
     output_file_prefix = "OSIRISData_hybrid_20240811_161147_OSIRIS_run-5_20240811_161029_rs_processed"
+    density = True
+
+    if density:
+        accumulator = density_files([filename])
+        plot_density(accumulator, output_file_prefix)
+        return
+
     rec_x = read_data(filename, "recX")
     rec_y = read_data(filename, "recY")
     rec_z = read_data(filename, "recZ")
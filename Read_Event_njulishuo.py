@@ -1,9 +1,65 @@
+import json
+import logging
 import numpy as np
 import os
 import pandas as pd
 import uproot
 from tqdm import tqdm
 import argparse
+import awkward as ak
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from column_cache import content_fingerprint
+from prefetch import PREFETCH_BYTES, PREFETCH_DEPTH, prefetch_iter, prefetch_map
+from processed_io import EVENTS_TREE, METADATA_TREE, PARQUET_METADATA_KEY
+from run_catalog import catalog_path, connect, raw_identity, record_conversion
+from run_metrics import FileMetrics, LOG_LEVELS, METRICS_FILE, SUMMARY_FILE, append_line, configure_logging, write_record, write_summary
+
+logger = logging.getLogger(__name__)
+
+N_PMT = 76
+# Cluster charge per MeV of visible energy, used when no calibration table covers a file.
+CHARGE_PER_MEV = 436.0
+
+Jagged = namedtuple("Jagged", ["values", "offsets"])
+
+ROOT_COMPRESSION = {"lz4": uproot.LZ4(1), "zstd": uproot.ZSTD(5), "zlib": uproot.ZLIB(1), "none": None}
+PARQUET_COMPRESSION = {"lz4": "lz4", "zstd": "zstd", "zlib": "gzip", "none": "none"}
+# A file whose every entry is vetoed has no events to write; both converters report it as an error.
+NO_CLUSTERS_ERROR = "no clusters survive the veto"
+PROCESSED_LOG = "processed_files.txt"
+ERROR_LOG = "error_log.txt"
+# Entries per basket when writing processed files.
+BASKET_ENTRIES = 200000
+# Dtypes of the processed cluster columns. Per-file constants (File_time, weight, the trigger
+# time range, charge_per_mev) are not columns: they are written once to METADATA_TREE and kept
+# in DataFrame.attrs in memory.
+PROCESSED_SCHEMA = {
+    'rec_time': np.int64,
+    'recX': np.float32,
+    'recY': np.float32,
+    'recZ': np.float32,
+    'Evis': np.float32,
+    'Multi_cluster_check': np.bool_,
+    'FiredPMT': np.uint8,
+}
+
+# Branches read by the converter. "veto" branches are read for every entry and decide which
+# entries survive; "payload" and the first available "vertex" group are then read only for
+# the surviving entries.
+BRANCH_MANIFEST = {
+    "veto": ["muonTag", "deltaTLSMuon", "deltaTMuon", "n_sec", "n_nsec", "clusterCharge"],
+    "payload": ["recT", "IDhit_pmtId"],
+    "vertex": ["cbfRecVertex/cbfRecVertex.fCoordinates.f", "recPos/recPos.fCoordinates.f"],
+}
+
+
+def time_stamp_ns(n_sec, n_nsec):
+    # Exact in int64; n_sec * 1e9 in float64 is only good to 256 ns at current epoch values.
+    return n_sec.astype(np.int64) * 1_000_000_000 + n_nsec
+
 
 def process_branch(branch_data):
     if isinstance(branch_data, np.ndarray):
@@ -23,7 +79,7 @@ def read_single_tree(input_path, tree_name):
         for branch_name in tqdm(tree.keys(), desc="Reading tree: {}".format(tree_name)):
             try:
                 branch_data = tree[branch_name].array(library="np")
-                print(f"Branch: {branch_name}, Data Type: {type(branch_data)}")
+                logger.debug("Branch: %s, Data Type: %s", branch_name, type(branch_data))
                 if isinstance(branch_data, (np.int_, np.float64, np.bool_, np.ndarray)):
                     branches[branch_name] = branch_data
                 elif hasattr(branch_data, "__len__") and not isinstance(branch_data, str):
@@ -33,7 +89,7 @@ def read_single_tree(input_path, tree_name):
                 else:
                     branches[branch_name] = branch_data
             except Exception as e:
-                print(f"Skipping branch {branch_name} due to error: {e}")
+                logger.warning("Skipping branch %s due to error: %s", branch_name, e)
         df = pd.DataFrame(branches)
         return df
 
@@ -48,7 +104,7 @@ def read_data(input_path, tree_name1, tree_name2):
     elif os.path.isdir(input_path):
         root_files = sorted([f for f in os.listdir(input_path) if f.endswith('.root')])
         if not root_files:
-            print("No ROOT files found in the specified directory.")
+            logger.error("No ROOT files found in the specified directory.")
             return None
         dataframes = []
         entry_offset = 0
@@ -67,140 +123,629 @@ def read_data(input_path, tree_name1, tree_name2):
         else:
             return None
     else:
-        print("Invalid input path. Please provide a valid file or directory path.")
+        logger.error("Invalid input path. Please provide a valid file or directory path.")
         return None
 
 
+def readable_branches(tree):
+    skipped = (uproot.interpretation.grouped.AsGrouped, uproot.interpretation.identify.UnknownInterpretation)
+    return [name for name in tree.keys() if not isinstance(tree[name].interpretation, skipped)]
+
+
+def offsets_from_counts(counts):
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def arrays_to_columns(arrays):
+    columns = {}
+    for name, array in arrays.items():
+        if array.ndim == 1:
+            columns[name] = ak.to_numpy(array)
+        elif array.ndim == 2:
+            columns[name] = Jagged(ak.to_numpy(ak.flatten(array)), offsets_from_counts(ak.to_numpy(ak.num(array))))
+        else:
+            logger.warning("Skipping branch %s: nested jagged branches are not supported", name)
+    return columns
+
+
+def locate_branches(trees):
+    branches = {}
+    for tree in trees:
+        for name in readable_branches(tree):
+            branches.setdefault(name, tree[name])
+    return branches
+
+
+def manifest_branches(branches):
+    names = BRANCH_MANIFEST["veto"] + BRANCH_MANIFEST["payload"]
+    missing = [name for name in names if name not in branches]
+    if missing:
+        raise KeyError(f"Missing branches required by the converter: {missing}")
+    for prefix in BRANCH_MANIFEST["vertex"]:
+        if all(prefix + axis in branches for axis in "XYZ"):
+            return BRANCH_MANIFEST["veto"], BRANCH_MANIFEST["payload"] + [prefix + axis for axis in "XYZ"]
+    raise KeyError(f"No vertex branches found, tried: {BRANCH_MANIFEST['vertex']}")
+
+
+def select_entries(column, mask):
+    if isinstance(column, Jagged):
+        return select_events(column, mask)
+    return column[mask]
+
+
+def surviving_ranges(branch, mask, entry_start):
+    # Merge the branch's baskets that contain at least one surviving entry into contiguous
+    # entry ranges, so baskets holding only vetoed entries are never decompressed.
+    entry_stop = entry_start + len(mask)
+    edges = np.unique(np.clip(np.asarray(branch.entry_offsets), entry_start, entry_stop))
+    if len(edges) < 2:
+        return []
+    survivors = np.add.reduceat(mask.astype(np.int64), edges[:-1] - entry_start)
+    keep = np.concatenate([[False], survivors > 0, [False]])
+    change = np.flatnonzero(keep[1:] != keep[:-1])
+    return list(zip(edges[change[::2]], edges[change[1::2]]))
+
+
+def basket_bytes(branch, entry_start, entry_stop):
+    # Compressed size of the baskets overlapping [entry_start, entry_stop), i.e. what reading
+    # that range costs in I/O.
+    offsets = np.asarray(branch.entry_offsets)
+    first = max(np.searchsorted(offsets, entry_start, side="right") - 1, 0)
+    last = min(np.searchsorted(offsets, entry_stop, side="left"), branch.num_baskets)
+    return sum(branch.basket_compressed_bytes(i) for i in range(first, last))
+
+
+def read_surviving_entries(branch, mask, entry_start, metrics=None):
+    ranges = surviving_ranges(branch, mask, entry_start)
+    if metrics is not None:
+        metrics.add_bytes(sum(basket_bytes(branch, start, stop) for start, stop in ranges))
+    pieces = [
+        branch.array(entry_start=start, entry_stop=stop, library="ak")[mask[start - entry_start:stop - entry_start]]
+        for start, stop in ranges
+    ]
+    if not pieces:
+        return branch.array(entry_start=entry_start, entry_stop=entry_start, library="ak")
+    return ak.concatenate(pieces)
+
+
+def read_pruned_columns(file, tree_name1, tree_name2, entry_start=0, entry_stop=None, metrics=None):
+    if metrics is None:
+        metrics = FileMetrics()
+    branches = locate_branches([file[tree_name1], file[tree_name2]])
+    veto_names, payload_names = manifest_branches(branches)
+    if entry_stop is None:
+        entry_stop = branches[veto_names[0]].num_entries
+
+    with metrics.stage("read"):
+        veto_arrays = {name: branches[name].array(entry_start=entry_start, entry_stop=entry_stop, library="ak") for name in veto_names}
+    metrics.add_bytes(sum(basket_bytes(branches[name], entry_start, entry_stop) for name in veto_names))
+    with metrics.stage("flatten"):
+        veto = arrays_to_columns(veto_arrays)
+    with metrics.stage("veto"):
+        time_stamp = time_stamp_ns(veto['n_sec'], veto['n_nsec'])
+        mask = veto_mask(veto, metrics)
+        columns = {name: select_entries(column, mask) for name, column in veto.items()}
+    metrics.add_events(len(mask))
+
+    with metrics.stage("read"):
+        payload_arrays = {name: read_surviving_entries(branches[name], mask, entry_start, metrics) for name in payload_names}
+    with metrics.stage("flatten"):
+        columns.update(arrays_to_columns(payload_arrays))
+    return columns, (time_stamp.min(), time_stamp.max())
+
+
+def iterate_pruned_columns(input_path, tree_name1, tree_name2, step_size=100000, metrics=None):
+    with uproot.open(input_path) as file:
+        num_entries = file[tree_name1].num_entries
+        if file[tree_name2].num_entries != num_entries:
+            raise ValueError(f"{tree_name1} and {tree_name2} have different entry counts: {num_entries} != {file[tree_name2].num_entries}")
+        for entry_start in range(0, num_entries, step_size):
+            yield read_pruned_columns(file, tree_name1, tree_name2, entry_start, min(entry_start + step_size, num_entries), metrics)
+
+
 def calculate_fired_pmt(pmt_ids):
-    onePMThits = np.zeros(76, dtype=int)
+    onePMThits = np.zeros(N_PMT, dtype=int)
     for pmt_id in pmt_ids:
         onePMThits[pmt_id] += 1
     fired_pmt_count = np.sum(onePMThits > 0)
     return fired_pmt_count
 
 
-def process_data(df):
-    df['Time_stamp'] = df['n_sec'] * 1e9 + df['n_nsec']
-    File_time = (df['Time_stamp'].max() - df['Time_stamp'].min()) / 1.0e9
-    Time_weight = 1.0 / File_time
+def jagged_lengths(column):
+    return np.fromiter((len(item) for item in column), dtype=np.int64, count=len(column))
+
+
+def jagged_to_flat(column):
+    values = np.concatenate(list(column)) if len(column) > 0 else np.array([], dtype=np.int64)
+    return Jagged(values, offsets_from_counts(jagged_lengths(column)))
+
+
+def frame_to_columns(df):
+    return {name: jagged_to_flat(df[name]) if df[name].dtype == object else df[name].to_numpy() for name in df.columns}
+
+
+def jagged_counts(jagged):
+    return np.diff(jagged.offsets)
+
+
+def select_events(jagged, mask):
+    counts = jagged_counts(jagged)
+    return Jagged(jagged.values[np.repeat(mask, counts)], offsets_from_counts(counts[mask]))
+
+
+def jagged_head(jagged, counts):
+    if np.array_equal(jagged_counts(jagged), counts):
+        return jagged.values
+    starts = np.repeat(jagged.offsets[:-1] - offsets_from_counts(counts)[:-1], counts)
+    return jagged.values[starts + np.arange(counts.sum())]
+
+
+def jagged_sum(jagged):
+    # Accumulate item by item across all events at once, so each event is summed
+    # in the same order (and with the same rounding) as Python's sum().
+    counts = jagged_counts(jagged)
+    sums = np.zeros(len(counts), dtype=jagged.values.dtype)
+    for j in range(counts.max() if len(counts) else 0):
+        has_item = counts > j
+        sums[has_item] += jagged.values[jagged.offsets[:-1][has_item] + j]
+    return sums
+
 
-    df_filtered = df.copy()
-    df_filtered = df_filtered[(df['muonTag'] == False) & (df['deltaTLSMuon'] > 1e6) & (df['deltaTMuon'] > 1e6) & (df['clusterCharge'].apply(len) >= 1)]
-    df_filtered['Evis'] = df_filtered['clusterCharge'].apply(lambda x: sum(x) / 436.0)
-    df_filtered['FiredPMT'] = df_filtered['IDhit_pmtId'].apply(calculate_fired_pmt)
-    if 'cbfRecVertex' in df.columns:
-        df_filtered['recX'] = df_filtered['cbfRecVertex/cbfRecVertex.fCoordinates.fX']
-        df_filtered['recY'] = df_filtered['cbfRecVertex/cbfRecVertex.fCoordinates.fY']
-        df_filtered['recZ'] = df_filtered['cbfRecVertex/cbfRecVertex.fCoordinates.fZ']
+def count_fired_pmt(pmt_values, offsets, return_occupancy=False):
+    pmt_values = np.asarray(pmt_values, dtype=np.int64)
+    n_events = len(offsets) - 1
+    if pmt_values.size and (pmt_values.min() < 0 or pmt_values.max() >= N_PMT):
+        raise ValueError(f"PMT id out of range [0, {N_PMT}): {pmt_values.min()}..{pmt_values.max()}")
+    event_index = np.repeat(np.arange(n_events, dtype=np.int64), np.diff(offsets))
+    keys = event_index * N_PMT + pmt_values
+    if return_occupancy:
+        occupancy = np.bincount(keys, minlength=n_events * N_PMT).reshape(n_events, N_PMT).astype(np.uint32)
+        return np.count_nonzero(occupancy, axis=1).astype(np.int64), occupancy
+    fired = np.zeros(n_events * N_PMT, dtype=bool)
+    fired[keys] = True
+    return fired.reshape(n_events, N_PMT).sum(axis=1), None
+
+
+def veto_cuts(columns):
+    return [
+        ("muonTag", columns['muonTag'] == False),
+        ("deltaTLSMuon", columns['deltaTLSMuon'] > 1e6),
+        ("deltaTMuon", columns['deltaTMuon'] > 1e6),
+        ("clusterCharge", jagged_counts(columns['clusterCharge']) >= 1),
+    ]
+
+
+def veto_mask(columns, metrics=None):
+    # With metrics, the cut flow records the entries surviving each successive cut.
+    mask = np.ones(len(columns['muonTag']), dtype=bool)
+    if metrics is not None:
+        metrics.cut("triggers", len(mask))
+    for name, passed in veto_cuts(columns):
+        mask &= passed
+        if metrics is not None:
+            metrics.cut(name, np.count_nonzero(mask))
+    return mask
+
+
+def select_clusters(columns, metrics=None, charge_per_mev=CHARGE_PER_MEV):
+    if metrics is None:
+        metrics = FileMetrics()
+    with metrics.stage("veto"):
+        mask = veto_mask(columns)
+    with metrics.stage("flatten"):
+        cluster_charge = select_events(columns['clusterCharge'], mask)
+        cluster_counts = jagged_counts(cluster_charge)
+        Evis = jagged_sum(cluster_charge) / charge_per_mev
+    with metrics.stage("fired_pmt"):
+        FiredPMT, _ = count_fired_pmt(*select_events(columns['IDhit_pmtId'], mask))
+    if 'cbfRecVertex/cbfRecVertex.fCoordinates.fX' in columns:
+        vertex = 'cbfRecVertex/cbfRecVertex.fCoordinates.f'
     else:
-        df_filtered['recX'] = df_filtered['recPos/recPos.fCoordinates.fX']
-        df_filtered['recY'] = df_filtered['recPos/recPos.fCoordinates.fY']
-        df_filtered['recZ'] = df_filtered['recPos/recPos.fCoordinates.fZ']
-
-    processed_data = {
-        'rec_time': [],
-        'recX': [],
-        'recY': [],
-        'recZ': [],
-        'Evis': [],
-        'Multi_cluster_check': [],
-        'FiredPMT': []
-    }
+        vertex = 'recPos/recPos.fCoordinates.f'
+
+    with metrics.stage("flatten"):
+        clusters = {
+            'rec_time': np.rint(jagged_head(select_events(columns['recT'], mask), cluster_counts)),
+            'recX': jagged_head(select_events(columns[vertex + 'X'], mask), cluster_counts),
+            'recY': jagged_head(select_events(columns[vertex + 'Y'], mask), cluster_counts),
+            'recZ': jagged_head(select_events(columns[vertex + 'Z'], mask), cluster_counts),
+            'Evis': np.repeat(Evis, cluster_counts),
+            'Multi_cluster_check': np.repeat(cluster_counts >= 2, cluster_counts),
+            'FiredPMT': np.repeat(FiredPMT, cluster_counts),
+        }
+        clusters = {name: values.astype(PROCESSED_SCHEMA[name], copy=False) for name, values in clusters.items()}
+    metrics.cut("clusters", len(clusters['rec_time']))
+    return clusters
 
-    for _, row in tqdm(df_filtered.iterrows(), total=len(df_filtered), desc="Processing Rows"):
-        for j in range(len(row['clusterCharge'])):
-            processed_data['FiredPMT'].append(int(row['FiredPMT']))
-            processed_data['rec_time'].append(row['recT'][j])
-            processed_data['recX'].append(row['recX'][j])
-            processed_data['recY'].append(row['recY'][j])
-            processed_data['recZ'].append(row['recZ'][j])
-            processed_data['Evis'].append(row['Evis'])
-            if j >= 1:
-                processed_data['Multi_cluster_check'].append(True)
-                if len(processed_data['Multi_cluster_check']) > 1: 
-                    processed_data['Multi_cluster_check'][-2] = True
-            else:
-                processed_data['Multi_cluster_check'].append(False)
-
-    processed_data['rec_time'] = np.array(processed_data['rec_time'])
-    processed_data['recX'] = np.array(processed_data['recX'])
-    processed_data['recY'] = np.array(processed_data['recY'])
-    processed_data['recZ'] = np.array(processed_data['recZ'])
-    processed_data['Evis'] = np.array(processed_data['Evis'])
-    processed_data['FiredPMT'] = np.array(processed_data['FiredPMT'])
-    
-    actual_time_range = (processed_data['rec_time'].max() - processed_data['rec_time'].min()) / 1e9 
+
+def check_time_range(rec_time_min, rec_time_max, File_time, mean_evis):
+    actual_time_range = (rec_time_max - rec_time_min) / 1e9
     if abs(actual_time_range - File_time) >= 1:
-        print(f'警告: 时间差距超出范围！实际时间范围: {actual_time_range:.2f}秒，期望时间范围: {File_time:.2f}秒')   
+        logger.warning(f'警告: 时间差距超出范围！实际时间范围: {actual_time_range:.2f}秒，期望时间范围: {File_time:.2f}秒')
     else:
-        meancharge = np.mean(processed_data['Evis'])
-        print(f'Mean charge: {meancharge:.6f}')
-
-    processed_df = pd.DataFrame({
-        'rec_time': processed_data['rec_time'],
-        'recX': processed_data['recX'],
-        'recY': processed_data['recY'],
-        'recZ': processed_data['recZ'],
-        'Evis': processed_data['Evis'],
-        'Multi_cluster_check': processed_data['Multi_cluster_check'],
-        'FiredPMT': processed_data['FiredPMT'],
-        'weight': np.ones(len(processed_data['rec_time'])) * Time_weight,
-        'File_time': np.ones(len(processed_data['rec_time'])) * File_time,
-    })
+        logger.info(f'Mean charge: {mean_evis:.6f}')
+
+
+def load_calibration(path):
+    # Table written by Evis_plot.calibrate_files: one charge_per_mev per file or time bin.
+    table = pd.read_csv(path)
+    table = table[np.isfinite(table['charge_per_mev'])].sort_values('start_ns')
+    return table[['start_ns', 'stop_ns', 'charge_per_mev']].reset_index(drop=True)
+
+
+def lookup_charge_per_mev(calibration, time_ns):
+    # The entry that started last at or before time_ns; earlier times use the first entry.
+    if calibration is None or len(calibration) == 0:
+        return CHARGE_PER_MEV
+    i = max(np.searchsorted(calibration['start_ns'].to_numpy(), time_ns, side='right') - 1, 0)
+    return float(calibration['charge_per_mev'].iloc[i])
+
+
+def file_metadata(time_stamp_range, charge_per_mev):
+    File_time = (time_stamp_range[1] - time_stamp_range[0]) / 1.0e9
+    return {
+        'File_time': File_time,
+        'weight': 1.0 / File_time,
+        'start_ns': int(time_stamp_range[0]),
+        'stop_ns': int(time_stamp_range[1]),
+        'charge_per_mev': charge_per_mev,
+    }
+
+
+def process_columns(columns, time_stamp_range=None, metrics=None, calibration=None):
+    if time_stamp_range is None:
+        Time_stamp = time_stamp_ns(columns['n_sec'], columns['n_nsec'])
+        time_stamp_range = (Time_stamp.min(), Time_stamp.max())
+    metadata = file_metadata(time_stamp_range, lookup_charge_per_mev(calibration, time_stamp_range[0]))
+
+    processed_data = select_clusters(columns, metrics, metadata['charge_per_mev'])
+    if len(processed_data['rec_time']) == 0:
+        raise ValueError(NO_CLUSTERS_ERROR)
+    check_time_range(processed_data['rec_time'].min(), processed_data['rec_time'].max(), metadata['File_time'], np.mean(processed_data['Evis'], dtype=np.float64))
+
+    processed_df = pd.DataFrame(processed_data)
+    processed_df.attrs.update(metadata)
     return processed_df
 
 
-def save_to_root(df, file_path):
-    with uproot.recreate(file_path) as f:
-        for column in tqdm(df.columns, desc="Saving Columns"):
+def process_data(df, calibration=None):
+    df['Time_stamp'] = time_stamp_ns(df['n_sec'], df['n_nsec'])
+    return process_columns(frame_to_columns(df), calibration=calibration)
+
+
+def parquet_path(file_path):
+    root, ext = os.path.splitext(file_path)
+    return root + ".parquet" if ext == ".root" else file_path + ".parquet"
+
+
+def write_parquet_chunk(writer, file_path, df, compression="lz4", metadata=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if writer is None:
+        schema = table.schema.with_metadata({**(table.schema.metadata or {}), PARQUET_METADATA_KEY: json.dumps(metadata or {})})
+        writer = pq.ParquetWriter(parquet_path(file_path), schema, compression=PARQUET_COMPRESSION[compression])
+    writer.write_table(table)
+    return writer
+
+
+def append_to_root(f, df, layout="events"):
+    if layout == "events":
+        branches = {column: df[column].to_numpy() for column in df.columns}
+        if EVENTS_TREE in f:
+            f[EVENTS_TREE].extend(branches)
+        else:
+            f[EVENTS_TREE] = branches
+        return
+    for column in df.columns:
+        if column in f:
+            f[column].extend({column: df[column].to_numpy()})
+        else:
             f[column] = {column: df[column].to_numpy()}
 
 
-def main():
-    print("Welcome to njulishuo Event Reconstruction program.")
+def write_metadata(f, metadata):
+    # A one-entry tree holding the per-file constants.
+    f[METADATA_TREE] = {name: np.array([value]) for name, value in metadata.items()}
 
-    input_folder = "/junofs/users/njulishuo/OSIRIS/Raw_data/08/"
-    output_folder = "/junofs/users/njulishuo/OSIRIS/Processed_data/08/"
-    processed_log = os.path.join(output_folder, "processed_files.txt")
-    error_files = []
 
-    if os.path.exists(processed_log):
-        with open(processed_log, "r") as f:
-            processed_files = set(f.read().splitlines())
-    else:
-        processed_files = set()
+def save_to_root(df, file_path, layout="events", compression="lz4", parquet=False):
+    writer = None
+    metadata = dict(df.attrs)
+    with uproot.recreate(file_path, compression=ROOT_COMPRESSION[compression]) as f:
+        for start in tqdm(range(0, len(df), BASKET_ENTRIES), desc="Saving baskets"):
+            chunk = df.iloc[start:start + BASKET_ENTRIES]
+            append_to_root(f, chunk, layout)
+            if parquet:
+                writer = write_parquet_chunk(writer, file_path, chunk, compression, metadata)
+        if metadata:
+            write_metadata(f, metadata)
+    if writer is not None:
+        writer.close()
 
-    tree_name_01 = "cluster_reco"
-    tree_name_02 = "recoTree"
 
-    for root_file in sorted(os.listdir(input_folder)):
-        if root_file.endswith('.root') and root_file not in processed_files:
-            your_path = os.path.join(input_folder, root_file)
-            print(your_path)
-            save_path = os.path.join(output_folder, root_file.replace('.root', '_processed.root'))
-            
+def read_time_stamp_range(file, tree_name1, tree_name2, step_size=100000):
+    branches = locate_branches([file[tree_name1], file[tree_name2]])
+    time_stamp_min, time_stamp_max = np.iinfo(np.int64).max, np.iinfo(np.int64).min
+    for entry_start in range(0, branches['n_sec'].num_entries, step_size):
+        entry_stop = entry_start + step_size
+        time_stamp = time_stamp_ns(branches['n_sec'].array(entry_start=entry_start, entry_stop=entry_stop, library="np"),
+                                   branches['n_nsec'].array(entry_start=entry_start, entry_stop=entry_stop, library="np"))
+        time_stamp_min = min(time_stamp_min, time_stamp.min())
+        time_stamp_max = max(time_stamp_max, time_stamp.max())
+    return time_stamp_min, time_stamp_max
+
+
+def convert_file_streaming(input_path, file_path, tree_name1, tree_name2, step_size=100000, layout="events", compression="lz4", parquet=False, metrics=None, calibration=None,
+                           prefetch_depth=0, prefetch_bytes=PREFETCH_BYTES):
+    if metrics is None:
+        metrics = FileMetrics(input_path)
+    # The file metadata (and the Parquet schema carrying it) is needed before the first chunk is
+    # written, so the cheap n_sec/n_nsec pass runs before the chunk loop.
+    with uproot.open(input_path) as file, metrics.stage("read"):
+        time_stamp_min, time_stamp_max = read_time_stamp_range(file, tree_name1, tree_name2, step_size)
+        entries = file[tree_name1].num_entries
+    metadata = file_metadata((time_stamp_min, time_stamp_max), lookup_charge_per_mev(calibration, time_stamp_min))
+
+    rec_time_min, rec_time_max = np.inf, -np.inf
+    evis_sum = 0.0
+    n_clusters = 0
+    writer = None
+    # With prefetching, the next chunks are read and vetoed in a background thread, which keeps
+    # its own metrics so the two threads never update the same counters.
+    read_metrics = FileMetrics() if prefetch_depth else metrics
+    chunks = iterate_pruned_columns(input_path, tree_name1, tree_name2, step_size, read_metrics)
+    if prefetch_depth:
+        chunks = prefetch_iter(chunks, prefetch_depth, prefetch_bytes)
+    with uproot.recreate(file_path, compression=ROOT_COMPRESSION[compression]) as f:
+        for columns, _ in tqdm(chunks, desc="Processing chunks"):
+            processed_data = select_clusters(columns, metrics, metadata['charge_per_mev'])
+            if len(processed_data['rec_time']) == 0:
+                continue
+            rec_time_min = min(rec_time_min, processed_data['rec_time'].min())
+            rec_time_max = max(rec_time_max, processed_data['rec_time'].max())
+            evis_sum += processed_data['Evis'].sum(dtype=np.float64)
+            n_clusters += len(processed_data['rec_time'])
+
+            chunk = pd.DataFrame(processed_data)
+            with metrics.stage("write"):
+                append_to_root(f, chunk, layout)
+                if parquet:
+                    writer = write_parquet_chunk(writer, file_path, chunk, compression, metadata)
+        write_metadata(f, metadata)
+    if writer is not None:
+        writer.close()
+    if read_metrics is not metrics:
+        metrics.merge(read_metrics)
+    if n_clusters == 0:
+        raise ValueError(NO_CLUSTERS_ERROR)
+
+    check_time_range(rec_time_min, rec_time_max, metadata['File_time'], evis_sum / n_clusters)
+    return conversion_info((time_stamp_min, time_stamp_max), entries, n_clusters)
+
+
+def conversion_info(time_stamp_range, entries, clusters):
+    return {
+        "start_ns": int(time_stamp_range[0]),
+        "stop_ns": int(time_stamp_range[1]),
+        "File_time": (time_stamp_range[1] - time_stamp_range[0]) / 1.0e9,
+        "entries": int(entries),
+        "clusters": int(clusters),
+    }
+
+
+def read_raw_file(input_path, tree_name1, tree_name2):
+    # The reading half of convert_file, which the folder loop runs ahead of time.
+    metrics = FileMetrics()
+    with uproot.open(input_path) as file:
+        columns, time_stamp_range = read_pruned_columns(file, tree_name1, tree_name2, metrics=metrics)
+        entries = file[tree_name1].num_entries
+    return columns, time_stamp_range, entries, metrics
+
+
+def convert_file(input_path, file_path, tree_name1, tree_name2, step_size=None, metrics=None, calibration=None, raw=None, prefetch_depth=0, prefetch_bytes=PREFETCH_BYTES,
+                 **output_options):
+    # Returns the file's time range and entry/cluster counts for the run catalog. raw is the
+    # read_raw_file result when the file was already read.
+    if step_size:
+        return convert_file_streaming(input_path, file_path, tree_name1, tree_name2, step_size, metrics=metrics, calibration=calibration,
+                                      prefetch_depth=prefetch_depth, prefetch_bytes=prefetch_bytes, **output_options)
+    if metrics is None:
+        metrics = FileMetrics(input_path)
+    if raw is None:
+        raw = read_raw_file(input_path, tree_name1, tree_name2)
+    columns, time_stamp_range, entries, read_metrics = raw
+    metrics.merge(read_metrics)
+    process_df = process_columns(columns, time_stamp_range, metrics, calibration)
+    with metrics.stage("write"):
+        save_to_root(process_df, file_path, **output_options)
+    return conversion_info(time_stamp_range, entries, len(process_df))
+
+
+def convert_task(task, prefetched=None):
+    # prefetched: a future of the read_raw_file result, from the folder loop's read-ahead.
+    root_file, input_path, save_path, tree_name1, tree_name2, step_size, calibration, prefetch, output_options = task
+    temp_path = save_path + ".part"
+    metrics = FileMetrics(root_file)
+    try:
+        raw = None
+        if prefetched is not None:
+            with metrics.stage("wait"):
+                raw = prefetched.result()
+        info = convert_file(input_path, temp_path, tree_name1, tree_name2, step_size, metrics, calibration, raw, *prefetch, **output_options)
+        if not info:
+            return root_file, "未能处理数据", metrics.record("未能处理数据"), None
+        if os.path.exists(parquet_path(temp_path)):
+            os.replace(parquet_path(temp_path), parquet_path(save_path))
+        os.replace(temp_path, save_path)
+        with metrics.stage("fingerprint"):
+            info["raw_fingerprint"] = raw_identity(input_path)
+            info["processed_fingerprint"] = content_fingerprint(save_path)
+        return root_file, None, metrics.record(), info
+    except Exception as e:
+        for path in (temp_path, parquet_path(temp_path)):
+            if os.path.exists(path):
+                os.remove(path)
+        error = " ".join(str(e).split())
+        return root_file, error, metrics.record(error), None
+
+
+def future_result(future, root_file):
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        raise
+    except Exception as e:
+        error = f"worker failed: {e}"
+        return root_file, error, FileMetrics(root_file).record(error), None
+
+
+def isolated_result(task):
+    # A task that was running when a worker died, retried in a pool of its own so a file that
+    # kills its worker again (e.g. out of memory) is recorded as an error for that file only.
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        try:
+            return future_result(executor.submit(convert_task, task), task[0])
+        except BrokenProcessPool:
+            error = "worker died (out of memory?)"
+            return task[0], error, FileMetrics(task[0]).record(error), None
+
+
+def pool_results(tasks, workers):
+    # At most `workers` tasks are submitted at a time, so a worker dying, which breaks the pool
+    # and fails every submitted task with BrokenProcessPool, only takes the running tasks along.
+    # Those are retried one by one with isolated_result, and the rest go on in a new pool.
+    queue = deque(tasks)
+    while queue:
+        running = {}
+        broken = []
+        executor = ProcessPoolExecutor(max_workers=workers)
+        try:
+            while (queue or running) and not broken:
+                while queue and len(running) < workers:
+                    task = queue.popleft()
+                    running[executor.submit(convert_task, task)] = task
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    try:
+                        result = future_result(future, task[0])
+                    except BrokenProcessPool:
+                        broken.append(task)
+                        continue
+                    yield result
+        finally:
+            # Also on Ctrl-C: nothing queued is left to convert without being logged.
+            executor.shutdown(cancel_futures=True)
+        # Tasks that finished before the pool broke keep their result; the others are retried.
+        for future, task in running.items():
             try:
-                df = read_data(your_path, tree_name_01, tree_name_02)
-                if df is not None:
-                    process_df = process_data(df)
-                    save_to_root(process_df, save_path)
-                    with open(processed_log, "a") as f:
-                        f.write(root_file + "\n")
-                    print(f"处理完成: {root_file}")
-                else:
-                    print(f"未能处理数据: {root_file}")
-            except Exception as e:
-                print(f"处理文件 {root_file} 时出错: {e}")
-                error_files.append(root_file)
+                result = future_result(future, task[0])
+            except BrokenProcessPool:
+                broken.append(task)
                 continue
+            yield result
+        if broken:
+            logger.warning(f"A conversion worker died, retrying {len(broken)} files one at a time")
+            for task in broken:
+                yield isolated_result(task)
+
+
+def processed_name(root_file):
+    return root_file.replace('.root', '_processed.root')
+
+
+def read_processed_log(output_folder):
+    # Raw file names converted into output_folder, in conversion order.
+    processed_log = os.path.join(output_folder, PROCESSED_LOG)
+    if not os.path.exists(processed_log):
+        return []
+    with open(processed_log, "r") as f:
+        return f.read().splitlines()
+
+
+def conversion_task(root_file, input_folder, output_folder, tree_name1, tree_name2, step_size=None, calibration=None, prefetch=(0, PREFETCH_BYTES), output_options=None):
+    save_path = os.path.join(output_folder, processed_name(root_file))
+    return (root_file, os.path.join(input_folder, root_file), save_path, tree_name1, tree_name2, step_size, calibration, prefetch, output_options or {})
 
+
+def log_conversion(output_folder, catalog, task, result):
+    # Metrics record, run catalog entry and processed/error log line of one converted file.
+    root_file, error, record, info = result
+    write_record(os.path.join(output_folder, METRICS_FILE), record)
+    record_conversion(catalog, task[1], task[2], info, error)
+    if error is None:
+        append_line(os.path.join(output_folder, PROCESSED_LOG), root_file)
+        logger.info(f"处理完成: {root_file} ({record['events_per_s']:.0f} events/s)")
+    else:
+        append_line(os.path.join(output_folder, ERROR_LOG), f"{root_file}: {error}")
+        logger.error(f"处理文件 {root_file} 时出错: {error}")
+
+
+def convert_folder(input_folder, output_folder, tree_name1, tree_name2, workers=1, step_size=None, calibration=None, prefetch_depth=PREFETCH_DEPTH, prefetch_bytes=PREFETCH_BYTES,
+                   **output_options):
+    processed_files = set(read_processed_log(output_folder))
+    catalog = connect(catalog_path(output_folder))
+    tasks = [conversion_task(root_file, input_folder, output_folder, tree_name1, tree_name2, step_size, calibration, (prefetch_depth, prefetch_bytes), output_options)
+             for root_file in sorted(os.listdir(input_folder)) if root_file.endswith('.root') and root_file not in processed_files]
+
+    if workers > 1:
+        results = pool_results(tasks, workers)
+    elif prefetch_depth and not step_size:
+        # Read the next files while the current one is processed; chunked conversion prefetches
+        # its chunks instead.
+        prefetched = prefetch_map(lambda task: read_raw_file(task[1], task[3], task[4]), tasks, prefetch_depth, prefetch_bytes)
+        results = (convert_task(task, future) for task, future in prefetched)
+    else:
+        results = (convert_task(task) for task in tasks)
+
+    tasks_by_file = {task[0]: task for task in tasks}
+    error_files = []
+    records = []
+    try:
+        for result in tqdm(results, total=len(tasks), desc="Converting files"):
+            root_file, error, record, _ = result
+            log_conversion(output_folder, catalog, tasks_by_file[root_file], result)
+            records.append(record)
+            if error is not None:
+                error_files.append(root_file)
+    finally:
+        results.close()
+        catalog.close()
+
+    if records:
+        summary = write_summary(os.path.join(output_folder, SUMMARY_FILE), records)
+        logger.info(f"{summary['files']} files, {summary['events']} events, {summary['events_per_s']:.0f} events/s, stages: "
+                    + ", ".join(f"{name} {seconds:.1f} s" for name, seconds in summary['stages'].items()))
     if error_files:
-        log_file = os.path.join(output_folder, "error_log.txt")
-        with open(log_file, "w") as log:
-            log.write("以下文件处理时出错:\n")
-            for error_file in error_files:
-                log.write(f"{error_file}\n")
-        print(f"错误日志已保存到 {log_file}")
+        logger.error(f"{len(error_files)} 个文件处理时出错，错误日志已保存到 {os.path.join(output_folder, ERROR_LOG)}")
+    return error_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert OSIRIS raw ROOT files into processed cluster files.")
+    parser.add_argument("--input-folder", default="/junofs/users/njulishuo/OSIRIS/Raw_data/08/")
+    parser.add_argument("--output-folder", default="/junofs/users/njulishuo/OSIRIS/Processed_data/08/")
+    parser.add_argument("--workers", type=int, default=1, help="number of files converted in parallel")
+    parser.add_argument("--step-size", type=int, default=None, help="convert in chunks of this many entries to bound memory")
+    parser.add_argument("--layout", choices=["events", "columns"], default="events", help="one 'events' tree, or the legacy one tree per column")
+    parser.add_argument("--compression", choices=sorted(ROOT_COMPRESSION), default="lz4", help="lz4 for speed, zstd for size")
+    parser.add_argument("--parquet", action="store_true", help="also write a Parquet copy next to each processed file")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH_DEPTH, help="files (or chunks with --step-size) read ahead in background threads, 0 to disable")
+    parser.add_argument("--prefetch-memory", type=float, default=PREFETCH_BYTES / 1024**2, help="MiB of read-ahead data held at once")
+    parser.add_argument("--calibration", default=None, help=f"Evis calibration table (CSV) from Evis_plot; {CHARGE_PER_MEV} charge/MeV without one")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="INFO", help="DEBUG also prints every branch read")
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+    logger.info("Welcome to njulishuo Event Reconstruction program.")
+
+    tree_name_01 = "cluster_reco"
+    tree_name_02 = "recoTree"
+    calibration = load_calibration(args.calibration) if args.calibration else None
+    convert_folder(args.input_folder, args.output_folder, tree_name_01, tree_name_02, args.workers, args.step_size, calibration, args.prefetch, int(args.prefetch_memory * 1024**2),
+                   layout=args.layout, compression=args.compression, parquet=args.parquet)
 
 if __name__ == "__main__":
     main()
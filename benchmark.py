@@ -0,0 +1,155 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+import Read_Event_njulishuo
+from BiPo214_cut import select_prompt_and_delay
+from BiPo214_evolution import DEFAULT_CUTS
+from column_cache import write_atomic
+from Evis_plot import plot_and_fit
+from prefetch import PREFETCH_DEPTH
+from synthetic_data import generate_raw_file
+
+# read_data/process_data/save_to_root are the legacy DataFrame path; convert_file and
+# convert_file_chunked are what the converter runs (pruned column read, process_columns, write,
+# and in chunked mode the streaming writer with chunk prefetch).
+STAGES = ["read_data", "process_data", "save_to_root", "convert_file", "convert_file_chunked", "select_prompt_and_delay", "plot_and_fit"]
+DEFAULT_SIZES = [10000, 100000]
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+TIME_TOLERANCE = 1.25
+MEMORY_TOLERANCE = 1.25
+# Absolute slack so timer noise on stages that take a few milliseconds is not a regression.
+TIME_SLACK = 0.05
+BIPO_FRACTION = 0.005
+# Chunks per file in the convert_file_chunked stage.
+CHUNKS = 4
+
+
+def measure(function, repeat=3):
+    # Best wall time of `repeat` untraced runs, then one run under tracemalloc for the peak
+    # Python/NumPy heap, so the tracing overhead stays out of the timing.
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {"seconds": min(seconds), "peak_bytes": peak}
+
+
+def benchmark_size(n_events, workdir, repeat=3, seed=0):
+    raw_path = os.path.join(workdir, f"raw_{n_events}.root")
+    processed_path = os.path.join(workdir, f"processed_{n_events}.root")
+    converted_path = os.path.join(workdir, f"converted_{n_events}.root")
+    n_bipo = int(n_events * BIPO_FRACTION)
+    generate_raw_file(raw_path, n_events, n_bipo, seed=seed)
+
+    results = {}
+    raw_df, results["read_data"] = measure(lambda: Read_Event_njulishuo.read_data(raw_path, "cluster_reco", "recoTree"), repeat)
+    processed_df, results["process_data"] = measure(lambda: Read_Event_njulishuo.process_data(raw_df), repeat)
+    _, results["save_to_root"] = measure(lambda: Read_Event_njulishuo.save_to_root(processed_df, processed_path), repeat)
+    _, results["convert_file"] = measure(lambda: Read_Event_njulishuo.convert_file(raw_path, converted_path, "cluster_reco", "recoTree"), repeat)
+    _, results["convert_file_chunked"] = measure(lambda: Read_Event_njulishuo.convert_file(raw_path, converted_path, "cluster_reco", "recoTree", max(n_events // CHUNKS, 1),
+                                                                                          prefetch_depth=PREFETCH_DEPTH), repeat)
+    (_, prompt_count), results["select_prompt_and_delay"] = measure(lambda: select_prompt_and_delay(processed_df, *DEFAULT_CUTS), repeat)
+
+    def fit():
+        fit_result = plot_and_fit(processed_df['Evis'].to_numpy(), 500, 0.38, 0.65, 0.0, 3.0, os.path.join(workdir, f"Evis_fit_{n_events}.png"))
+        plt.close("all")
+        return fit_result
+    _, results["plot_and_fit"] = measure(fit, repeat)
+
+    print(f"{n_events} events: {prompt_count} Bi-Po pairs selected, {n_bipo} injected")
+    return results
+
+
+def environment():
+    return {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(), "machine": platform.machine()}
+
+
+def run_benchmarks(sizes, repeat=3, workdir=None, seed=0):
+    with tempfile.TemporaryDirectory(dir=workdir) as directory:
+        results = {str(n_events): benchmark_size(n_events, directory, repeat, seed) for n_events in sizes}
+    return {"environment": environment(), "results": results}
+
+
+def compare(current, baseline, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    regressions = []
+    for size, stages in current["results"].items():
+        for stage, result in stages.items():
+            reference = baseline["results"].get(size, {}).get(stage)
+            if reference is None:
+                continue
+            if result["seconds"] > reference["seconds"] * time_tolerance + TIME_SLACK:
+                regressions.append(f"{stage} @ {size}: {result['seconds']:.3f} s vs baseline {reference['seconds']:.3f} s")
+            if result["peak_bytes"] > reference["peak_bytes"] * memory_tolerance:
+                regressions.append(f"{stage} @ {size}: {result['peak_bytes'] / 1024**2:.1f} MiB vs baseline {reference['peak_bytes'] / 1024**2:.1f} MiB")
+    return regressions
+
+
+def print_results(current, baseline=None):
+    print(f"{'stage':<26}{'events':>10}{'seconds':>12}{'peak MiB':>12}{'vs baseline':>14}")
+    for size, stages in current["results"].items():
+        for stage in STAGES:
+            result = stages[stage]
+            reference = baseline["results"].get(size, {}).get(stage) if baseline else None
+            ratio = f"{result['seconds'] / reference['seconds']:.2f}x" if reference and reference["seconds"] > 0 else "-"
+            print(f"{stage:<26}{size:>10}{result['seconds']:>12.3f}{result['peak_bytes'] / 1024**2:>12.1f}{ratio:>14}")
+
+
+def write_json(path, data):
+    write_atomic(path, lambda f: f.write(json.dumps(data, indent=2).encode()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and measure peak memory of each pipeline stage on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="number of triggers per synthetic file")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="where the synthetic files are written, a temporary directory by default")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--output", default=None, help="also write this run's results as JSON")
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.sizes, args.repeat, args.workdir, args.seed)
+    if args.output:
+        write_json(args.output, current)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(current, baseline)
+
+    if args.save_baseline or baseline is None:
+        write_json(args.baseline, current)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if baseline["environment"] != current["environment"]:
+        print(f"Warning: baseline was recorded on {baseline['environment']}")
+    regressions = compare(current, baseline, args.time_tolerance, args.memory_tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import shutil
+import threading
+import numpy as np
+
+CACHE_DIR = os.environ.get("OSIRIS_COLUMN_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "osiris_columns"))
+MAX_CACHE_BYTES = 20 * 1024**3
+
+
+def source_stamp(filename):
+    stat = os.stat(filename)
+    return f"{os.path.abspath(filename)} {stat.st_size} {stat.st_mtime_ns}"
+
+
+def entry_dir(filename, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()[:16])
+
+
+def open_entry(filename, cache_dir=CACHE_DIR):
+    # One directory per source file; its "stamp" records the size and mtime the columns were
+    # built from, so a rewritten source file drops its stale columns on the next access.
+    entry = entry_dir(filename, cache_dir)
+    stamp_path = os.path.join(entry, "stamp")
+    stamp = source_stamp(filename)
+    if os.path.exists(stamp_path):
+        with open(stamp_path) as f:
+            if f.read() == stamp:
+                return entry
+        shutil.rmtree(entry, ignore_errors=True)
+    os.makedirs(entry, exist_ok=True)
+    write_atomic(stamp_path, lambda f: f.write(stamp.encode()))
+    return entry
+
+
+def write_atomic(path, write):
+    # Workers and their threads share the cache, so the temporary name is unique per thread.
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        write(f)
+    os.replace(temp_path, path)
+
+
+def file_size(path):
+    # 0 for a file another process evicted or replaced in the meantime.
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def entry_size(entry):
+    try:
+        names = os.listdir(entry)
+    except FileNotFoundError:
+        return 0
+    return sum(file_size(os.path.join(entry, name)) for name in names)
+
+
+def evict_lru(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, keep=None):
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        stamp_path = os.path.join(entry, "stamp")
+        try:
+            entries.append((os.path.getmtime(stamp_path), entry_size(entry), entry))
+        except (FileNotFoundError, NotADirectoryError):
+            # Not an entry, or evicted by another process since the listing.
+            continue
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        if entry != keep:
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+def cached_columns(filename, names, loader, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, attempts=3):
+    # Another process can evict the entry between writing and mapping the columns (once
+    # mapped, removing the files does not matter); it is built again, and if it keeps losing
+    # the race the columns are returned uncached.
+    for _ in range(attempts):
+        try:
+            return load_entry(filename, names, loader, cache_dir, max_bytes)
+        except (FileNotFoundError, FileExistsError):
+            continue
+    return loader(filename, names)
+
+
+def load_entry(filename, names, loader, cache_dir, max_bytes):
+    entry = open_entry(filename, cache_dir)
+    paths = {name: os.path.join(entry, name.replace("/", "__") + ".npy") for name in names}
+    missing = [name for name in names if not os.path.exists(paths[name])]
+    if missing:
+        for name, data in loader(filename, missing).items():
+            write_atomic(paths[name], lambda f: np.save(f, np.ascontiguousarray(data)))
+        evict_lru(cache_dir, max_bytes, keep=entry)
+    os.utime(os.path.join(entry, "stamp"))
+    return {name: np.load(paths[name], mmap_mode="r") for name in names}
+
+
+def content_fingerprint(filename, block_size=8 * 1024**2):
+    # Hash of the file content, stored in the file's cache entry so it is only recomputed
+    # when the file's size or mtime changes.
+    fingerprint_path = os.path.join(entry_dir(filename), "fingerprint")
+    try:
+        open_entry(filename)
+        with open(fingerprint_path) as f:
+            return f.read()
+    except (FileNotFoundError, FileExistsError):
+        pass
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    fingerprint = digest.hexdigest()
+    try:
+        write_atomic(fingerprint_path, lambda f: f.write(fingerprint.encode()))
+    except FileNotFoundError:
+        # The entry was evicted meanwhile; the hash is stored again next time.
+        pass
+    return fingerprint
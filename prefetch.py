@@ -0,0 +1,111 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Read-ahead for the file and chunk loops: the next items are opened and decompressed in
+# background threads (uproot's decompression and NumPy release the GIL) while the caller
+# works on the current one.
+PREFETCH_DEPTH = 2
+PREFETCH_BYTES = 2 * 1024**3
+
+
+def result_nbytes(result):
+    if hasattr(result, "memory_usage"):
+        return int(result.memory_usage(index=False).sum())
+    if hasattr(result, "nbytes"):
+        return int(result.nbytes)
+    if isinstance(result, dict):
+        return sum(result_nbytes(value) for value in result.values())
+    if isinstance(result, (tuple, list)):
+        return sum(result_nbytes(value) for value in result)
+    return 0
+
+
+def future_nbytes(future, size):
+    if future.cancelled() or future.exception() is not None:
+        return 0
+    return size(future.result())
+
+
+def prefetch_map(load, items, depth=PREFETCH_DEPTH, max_bytes=PREFETCH_BYTES, size=result_nbytes):
+    # Yields (item, future of load(item)) in order, with up to `depth` loads running or waiting
+    # on a pool of `depth` threads. Finished loads not yet consumed count against max_bytes, and
+    # running ones count as the largest result seen so far; a new load only starts if it fits.
+    # The next item is always loaded, so an item larger than the budget still goes through.
+    # Errors are left in the future for the caller's per-item error handling.
+    items = list(items)
+    pending = deque()
+    sizes = {}
+    largest = 0
+    with ThreadPoolExecutor(max_workers=max(depth, 1)) as executor:
+        try:
+            position = 0
+            while position < len(items) or pending:
+                for future in pending:
+                    if future.done() and future not in sizes:
+                        sizes[future] = future_nbytes(future, size)
+                        largest = max(largest, sizes[future])
+                buffered = sum(sizes.get(future, largest) for future in pending)
+                while position < len(items) and (not pending or (len(pending) < depth and buffered + largest <= max_bytes)):
+                    pending.append(executor.submit(load, items[position]))
+                    buffered += largest
+                    position += 1
+                future = pending.popleft()
+                wait([future])
+                sizes.pop(future, None)
+                yield items[position - len(pending) - 1], future
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def prefetch_iter(iterable, depth=PREFETCH_DEPTH, max_bytes=PREFETCH_BYTES, size=result_nbytes):
+    # Runs a sequential iterator (e.g. the chunks of one file) in a background thread, keeping up
+    # to `depth` values and max_bytes ahead of the caller. Errors are raised at the value where
+    # they occurred.
+    depth = max(depth, 1)
+    buffer = deque()
+    state = {"bytes": 0, "done": False, "stop": False}
+    condition = threading.Condition()
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for value in iterator:
+                nbytes = size(value)
+                with condition:
+                    buffer.append((value, nbytes, None))
+                    state["bytes"] += nbytes
+                    condition.notify_all()
+                    condition.wait_for(lambda: state["stop"] or (len(buffer) < depth and state["bytes"] < max_bytes))
+                    if state["stop"]:
+                        break
+        except Exception as e:
+            with condition:
+                buffer.append((None, 0, e))
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+            with condition:
+                state["done"] = True
+                condition.notify_all()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            with condition:
+                condition.wait_for(lambda: buffer or state["done"])
+                if not buffer:
+                    return
+                value, nbytes, error = buffer.popleft()
+                state["bytes"] -= nbytes
+                condition.notify_all()
+            if error is not None:
+                raise error
+            yield value
+    finally:
+        with condition:
+            state["stop"] = True
+            condition.notify_all()
+        thread.join()
@@ -0,0 +1,83 @@
+import json
+import uproot
+
+from column_cache import cached_columns
+
+EVENTS_TREE = "events"
+# Per-file constants (File_time, weight, start_ns, stop_ns, charge_per_mev): a one-entry tree in
+# ROOT files, a JSON entry of the schema metadata in Parquet files.
+METADATA_TREE = "metadata"
+PARQUET_METADATA_KEY = "osiris_metadata"
+# Constants older converters wrote as one value per row.
+LEGACY_METADATA = ("File_time", "weight")
+
+
+def metadata_from_tree(file):
+    if METADATA_TREE not in file:
+        return {}
+    arrays = file[METADATA_TREE].arrays(library="np")
+    return {name: values[0].item() for name, values in arrays.items()}
+
+
+def metadata_from_parquet(schema):
+    metadata = schema.metadata or {}
+    key = PARQUET_METADATA_KEY.encode()
+    return json.loads(metadata[key]) if key in metadata else {}
+
+
+def column_names(filename):
+    if filename.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return set(pq.read_schema(filename).names)
+    with uproot.open(filename) as file:
+        if EVENTS_TREE in file:
+            return set(file[EVENTS_TREE].keys())
+        return set(file.keys(recursive=False, cycle=False)) - {METADATA_TREE}
+
+
+def read_metadata(filename):
+    if filename.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        metadata = metadata_from_parquet(pq.read_schema(filename))
+    else:
+        with uproot.open(filename) as file:
+            metadata = metadata_from_tree(file)
+    if not metadata:
+        # Files written before the metadata existed carry File_time/weight as full columns.
+        legacy = [name for name in LEGACY_METADATA if name in column_names(filename)]
+        columns = read_columns_uncached(filename, legacy)
+        metadata = {name: values[0].item() for name, values in columns.items() if len(values)}
+    return metadata
+
+
+def read_columns_uncached(filename, names):
+    # Stored columns only; per-file constants come from read_metadata instead of being
+    # expanded to one value per row.
+    if filename.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(filename)
+        stored = [name for name in names if name in parquet.schema_arrow.names]
+        table = parquet.read(columns=stored)
+        columns = {name: table.column(name).to_numpy() for name in stored}
+    else:
+        with uproot.open(filename) as file:
+            if EVENTS_TREE in file:
+                tree = file[EVENTS_TREE]
+                stored = [name for name in names if name in tree]
+                columns = tree.arrays(filter_name=stored, library="np") if stored else {}
+            else:
+                columns = {name: file[name][name].array(library="np") for name in names if name in file and name != METADATA_TREE}
+    missing = [name for name in names if name not in columns]
+    if missing:
+        raise KeyError(f"{missing} are not columns of {filename}; per-file constants are read with read_metadata")
+    return {name: columns[name] for name in names}
+
+
+def read_columns(filename, names, use_cache=True):
+    if use_cache:
+        return cached_columns(filename, names, read_columns_uncached)
+    return read_columns_uncached(filename, names)
+
+
+def read_column(filename, name, use_cache=True):
+    return read_columns(filename, [name], use_cache)[name]
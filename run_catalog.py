@@ -0,0 +1,195 @@
+import argparse
+import os
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+import uproot
+
+from column_cache import content_fingerprint
+from processed_io import read_columns, read_metadata
+
+CATALOG_FILE = "run_catalog.sqlite"
+
+# One row per raw or processed file. start_ns/stop_ns are trigger timestamps (n_sec * 1e9 + n_nsec)
+# of the raw file, copied to its processed file; processed files indexed without their raw file
+# take them from their metadata, or fall back to their rec_time range for older files.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    source TEXT,
+    start_ns INTEGER,
+    stop_ns INTEGER,
+    file_time REAL,
+    entries INTEGER,
+    clusters INTEGER,
+    status TEXT NOT NULL,
+    error TEXT,
+    fingerprint TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    updated TEXT
+);
+CREATE INDEX IF NOT EXISTS files_by_time ON files (kind, start_ns, stop_ns);
+"""
+COLUMNS = ["path", "kind", "name", "source", "start_ns", "stop_ns", "file_time", "entries", "clusters", "status", "error", "fingerprint", "size", "mtime_ns", "updated"]
+OVERWRITTEN = {"status", "error", "size", "mtime_ns", "updated"}
+
+
+def catalog_path(folder):
+    return os.path.join(folder, CATALOG_FILE)
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=60)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def open_catalog(path):
+    # For lookups: connect() would create an empty catalog, and every query on it would quietly
+    # find nothing.
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No run catalog at {path}; build it with `python run_catalog.py index {os.path.dirname(path) or '.'}`")
+    return connect(path)
+
+
+def to_ns(value):
+    # Anything pd.Timestamp accepts; naive times are taken as UTC, like n_sec.
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+    return int(timestamp.as_unit("ns").value)
+
+
+def record_file(conn, path, kind, status, **fields):
+    path = os.path.abspath(path)
+    row = {name: None for name in COLUMNS}
+    row.update(fields, path=path, kind=kind, name=os.path.basename(path), status=status, updated=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    if os.path.exists(path):
+        stat = os.stat(path)
+        row.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    # Fields not given keep their stored value; status and error always describe the latest attempt.
+    updates = ", ".join(f"{name} = excluded.{name}" if name in OVERWRITTEN else f"{name} = COALESCE(excluded.{name}, {name})" for name in COLUMNS if name != "path")
+    with conn:
+        conn.execute(f"INSERT INTO files ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+                     f"ON CONFLICT(path) DO UPDATE SET {updates}", [row[name] for name in COLUMNS])
+
+
+def record_conversion(conn, raw_path, processed_path, info, error=None):
+    if error is not None:
+        record_file(conn, raw_path, "raw", "failed", error=error)
+        return
+    record_file(conn, raw_path, "raw", "processed", error=None, start_ns=info["start_ns"], stop_ns=info["stop_ns"], file_time=info["File_time"],
+                entries=info["entries"], clusters=info["clusters"], fingerprint=info.get("raw_fingerprint"))
+    record_file(conn, processed_path, "processed", "processed", source=os.path.abspath(raw_path), start_ns=info["start_ns"], stop_ns=info["stop_ns"],
+                file_time=info["File_time"], clusters=info["clusters"], fingerprint=info.get("processed_fingerprint"))
+
+
+def find_files(conn, start=None, stop=None, kind="processed", status="processed"):
+    # Files whose [start_ns, stop_ns] overlaps [start, stop), in time order.
+    query = "SELECT path FROM files WHERE kind = ? AND status = ?"
+    params = [kind, status]
+    if stop is not None:
+        query += " AND start_ns < ?"
+        params.append(to_ns(stop))
+    if start is not None:
+        query += " AND stop_ns >= ?"
+        params.append(to_ns(start))
+    return [row["path"] for row in conn.execute(query + " ORDER BY start_ns", params)]
+
+
+def catalog_files(folder, time_range, kind="processed"):
+    conn = open_catalog(catalog_path(folder))
+    try:
+        return find_files(conn, *time_range, kind=kind)
+    finally:
+        conn.close()
+
+
+def is_current(conn, path):
+    row = conn.execute("SELECT size, mtime_ns FROM files WHERE path = ?", [os.path.abspath(path)]).fetchone()
+    if row is None:
+        return False
+    stat = os.stat(path)
+    return row["size"] == stat.st_size and row["mtime_ns"] == stat.st_mtime_ns
+
+
+def raw_file_info(path, tree_name="recoTree"):
+    with uproot.open(path) as file:
+        tree = file[tree_name]
+        time_stamp = tree["n_sec"].array(library="np").astype(np.int64) * 1_000_000_000 + tree["n_nsec"].array(library="np")
+        entries = tree.num_entries
+    return {"start_ns": int(time_stamp.min()), "stop_ns": int(time_stamp.max()), "File_time": (time_stamp.max() - time_stamp.min()) / 1e9, "entries": entries}
+
+
+def raw_identity(path):
+    # Raw files are written once, so the UUID ROOT stores in the file header, the size and the
+    # mtime identify one without hashing its content.
+    with uproot.open(path) as file:
+        uuid = file.file.uuid
+    stat = os.stat(path)
+    return f"{uuid} {stat.st_size} {stat.st_mtime_ns}"
+
+
+def processed_file_info(path):
+    metadata = read_metadata(path)
+    rec_time = np.asarray(read_columns(path, ["rec_time"])["rec_time"])
+    if len(rec_time) == 0:
+        return {"clusters": 0}
+    info = {"start_ns": int(rec_time.min()), "stop_ns": int(rec_time.max()), "File_time": float(metadata["File_time"]), "clusters": len(rec_time)}
+    info.update({name: metadata[name] for name in ("start_ns", "stop_ns") if name in metadata})
+    return info
+
+
+def index_folder(conn, folder, kind="processed", suffix=None):
+    # Backfill files written before the catalog existed; unchanged files are skipped on size and mtime.
+    suffix = suffix or ("_processed.root" if kind == "processed" else ".root")
+    indexed = 0
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if not name.endswith(suffix) or is_current(conn, path):
+            continue
+        try:
+            if kind == "processed":
+                info, fingerprint = processed_file_info(path), content_fingerprint(path)
+            else:
+                info, fingerprint = raw_file_info(path), raw_identity(path)
+            record_file(conn, path, kind, "processed", error=None, start_ns=info.get("start_ns"), stop_ns=info.get("stop_ns"), file_time=info.get("File_time"),
+                        entries=info.get("entries"), clusters=info.get("clusters"), fingerprint=fingerprint)
+        except Exception as e:
+            record_file(conn, path, kind, "failed", error=" ".join(str(e).split()))
+        indexed += 1
+    return indexed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index raw/processed OSIRIS files and query them by time range.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    index_parser = subparsers.add_parser("index", help="add new or changed files of a folder to its catalog")
+    index_parser.add_argument("folder")
+    index_parser.add_argument("--kind", choices=["processed", "raw"], default="processed")
+    index_parser.add_argument("--catalog", default=None, help=f"defaults to <folder>/{CATALOG_FILE}")
+    query_parser = subparsers.add_parser("query", help="list the files overlapping a time range")
+    query_parser.add_argument("catalog")
+    query_parser.add_argument("--start", default=None)
+    query_parser.add_argument("--stop", default=None)
+    query_parser.add_argument("--kind", choices=["processed", "raw"], default="processed")
+    args = parser.parse_args()
+
+    if args.command == "index":
+        conn = connect(args.catalog or catalog_path(args.folder))
+        print(f"Indexed {index_folder(conn, args.folder, args.kind)} files")
+    else:
+        conn = open_catalog(args.catalog)
+        for path in find_files(conn, args.start, args.stop, args.kind):
+            print(path)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+from column_cache import write_atomic
+
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+METRICS_FILE = "metrics.jsonl"
+SUMMARY_FILE = "metrics_summary.json"
+
+
+def configure_logging(level="INFO"):
+    logging.basicConfig(level=getattr(logging, level.upper()), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+# Peak RSS before the last reset_peak_rss, which also resets ru_maxrss.
+process_peak = {"bytes": 0}
+
+
+def peak_rss():
+    # High-water mark of the whole process so far; ru_maxrss is in KiB on Linux and in bytes on macOS.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max(maxrss if sys.platform == "darwin" else maxrss * 1024, process_peak["bytes"])
+
+
+def reset_peak_rss():
+    # Linux only: writing 5 to clear_refs resets VmHWM, the peak RSS, to the current RSS.
+    process_peak["bytes"] = peak_rss()
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_since_reset():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+def append_line(path, line):
+    # A single O_APPEND write per record, so concurrent writers never interleave partial lines.
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (line + "\n").encode())
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FileMetrics:
+    # Stage timers, counters and cut flow for one input file. Stages may be entered several
+    # times (once per chunk); their times add up. bytes_read is data read from disk;
+    # column_bytes the in-memory size of the columns analysed, which may come from the
+    # memory-mapped column cache without any read.
+    # A named file resets the peak RSS (Linux), so peak_rss_bytes is the peak from its start to
+    # its record; memory held for files read ahead in other threads is included.
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.stages = {}
+        self.cut_flow = {}
+        self.events = 0
+        self.bytes_read = 0
+        self.column_bytes = 0
+        self.tracks_rss = filename is not None and reset_peak_rss()
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def cut(self, name, count):
+        self.cut_flow[name] = self.cut_flow.get(name, 0) + int(count)
+
+    def add_events(self, count):
+        self.events += int(count)
+
+    def add_bytes(self, count):
+        self.bytes_read += int(count)
+
+    def add_column_bytes(self, count):
+        self.column_bytes += int(count)
+
+    def merge(self, other):
+        # Adds the stages and counters of work done for this file elsewhere, e.g. a background read.
+        for name, seconds in other.stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        for name, count in other.cut_flow.items():
+            self.cut(name, count)
+        self.add_events(other.events)
+        self.add_bytes(other.bytes_read)
+        self.add_column_bytes(other.column_bytes)
+
+    def record(self, error=None):
+        wall_seconds = time.perf_counter() - self.start
+        return {
+            "file": self.filename,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "pid": os.getpid(),
+            "wall_seconds": wall_seconds,
+            "stages": self.stages,
+            "events": self.events,
+            "events_per_s": self.events / wall_seconds if wall_seconds > 0 else 0.0,
+            "bytes_read": self.bytes_read,
+            "column_bytes": self.column_bytes,
+            "peak_rss_bytes": peak_rss_since_reset() if self.tracks_rss else None,
+            "process_peak_rss_bytes": peak_rss(),
+            "cut_flow": self.cut_flow,
+            "error": error,
+        }
+
+
+def write_record(path, record):
+    append_line(path, json.dumps(record))
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records, n_slowest=5):
+    stages = {}
+    cut_flow = {}
+    for record in records:
+        for name, seconds in record["stages"].items():
+            stages[name] = stages.get(name, 0.0) + seconds
+        for name, count in record["cut_flow"].items():
+            cut_flow[name] = cut_flow.get(name, 0) + count
+    wall_seconds = sum(record["wall_seconds"] for record in records)
+    events = sum(record["events"] for record in records)
+    stage_seconds = sum(stages.values())
+    succeeded = [record for record in records if record["error"] is None]
+    measured = [record for record in records if record["peak_rss_bytes"] is not None]
+    return {
+        "files": len(records),
+        "failed": len(records) - len(succeeded),
+        "events": events,
+        "wall_seconds": wall_seconds,
+        "events_per_s": events / wall_seconds if wall_seconds > 0 else 0.0,
+        "bytes_read": sum(record["bytes_read"] for record in records),
+        "column_bytes": sum(record.get("column_bytes", 0) for record in records),
+        "process_peak_rss_bytes": max((record.get("process_peak_rss_bytes", record["peak_rss_bytes"]) for record in records), default=0),
+        "largest_peak_rss_files": [(record["file"], record["peak_rss_bytes"]) for record in sorted(measured, key=lambda r: r["peak_rss_bytes"], reverse=True)[:n_slowest]],
+        "stages": stages,
+        "stage_fraction": {name: seconds / stage_seconds for name, seconds in stages.items()} if stage_seconds > 0 else {},
+        "cut_flow": cut_flow,
+        "slowest_files": [(record["file"], record["wall_seconds"]) for record in sorted(succeeded, key=lambda r: r["wall_seconds"], reverse=True)[:n_slowest]],
+        "lowest_throughput_files": [(record["file"], record["events_per_s"]) for record in sorted(succeeded, key=lambda r: r["events_per_s"])[:n_slowest]],
+    }
+
+
+def summary_path(metrics_file):
+    return os.path.join(os.path.dirname(metrics_file), SUMMARY_FILE)
+
+
+def write_summary(path, records):
+    summary = summarize(records)
+    write_atomic(path, lambda f: f.write(json.dumps(summary, indent=2).encode()))
+    return summary
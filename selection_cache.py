@@ -0,0 +1,108 @@
+import hashlib
+import os
+import numpy as np
+
+from BiPo214_cut import ACCIDENTAL_WINDOWS, estimate_accidentals, find_coincidence_pairs, pair_frame, select_candidates
+from column_cache import content_fingerprint, write_atomic
+
+CACHE_DIR = os.environ.get("OSIRIS_SELECTION_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "osiris_selections"))
+MAX_CACHE_BYTES = 2 * 1024**3
+
+
+def normalize_cuts(cuts):
+    return tuple(float(cut) for cut in cuts)
+
+
+class SelectionCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, filenames, cuts, *extra):
+        digest = hashlib.sha1()
+        for filename in filenames:
+            digest.update(content_fingerprint(filename).encode())
+        digest.update(repr((normalize_cuts(cuts),) + extra).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (FileNotFoundError, ValueError, OSError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return arrays
+
+    def put(self, key, **arrays):
+        write_atomic(self.path(key), lambda f: np.savez(f, **arrays))
+        self.evict()
+
+    def entries(self):
+        # Other workers evict concurrently: an entry gone since the listing is left out.
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".npz"):
+                try:
+                    entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+                except FileNotFoundError:
+                    continue
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+        }
+
+
+def cached_selection(filename, df, cuts, cache, n_windows=ACCIDENTAL_WINDOWS):
+    # Same pairs as select_prompt_and_delay(df, *cuts) and same window counts as
+    # estimate_accidentals; on a cache hit both searches are skipped and the selected frame is
+    # rebuilt from the stored pair indices. Returns the candidates too, for the cut flow.
+    prompt_E_min, prompt_E_max, delay_E_min, delay_E_max, FV_r_min, FV_r_max, FV_z_min, FV_z_max, dt_min, dt_max, dr_max = normalize_cuts(cuts)
+    prompt_events, delay_events = select_candidates(df, prompt_E_min, prompt_E_max, delay_E_min, delay_E_max, FV_r_min, FV_r_max, FV_z_min, FV_z_max)
+    key = cache.key([filename], cuts, "selection", n_windows)
+    cached = cache.get(key)
+    if cached is not None:
+        selected = pair_frame(prompt_events, delay_events, cached["prompt_idx"], cached["delay_idx"])
+        return selected, int(cached["prompt_count"]), prompt_events, delay_events, cached["window_counts"]
+
+    prompt_idx, delay_idx = find_coincidence_pairs(prompt_events['rec_time'].to_numpy(), delay_events['rec_time'].to_numpy(), dt_min, dt_max)
+    merged = pair_frame(prompt_events, delay_events, prompt_idx, delay_idx)
+    keep = ((merged['dt'] >= dt_min) & (merged['dt'] <= dt_max) & (merged['dr'] <= dr_max)).to_numpy()
+    selected = merged[keep]
+    _, _, window_counts = estimate_accidentals(prompt_events, delay_events, dt_min, dt_max, dr_max, n_windows)
+    cache.put(key, prompt_idx=prompt_idx[keep], delay_idx=delay_idx[keep], dt=selected['dt'].to_numpy(),
+              dr=selected['dr'].to_numpy(), prompt_count=np.array(len(selected)), window_counts=window_counts)
+    return selected, len(selected), prompt_events, delay_events, window_counts
@@ -0,0 +1,164 @@
+import argparse
+import os
+import time
+import numpy as np
+import awkward as ak
+import uproot
+
+from Read_Event_njulishuo import BASKET_ENTRIES, CHARGE_PER_MEV, N_PMT
+
+PO214_HALF_LIFE = 164.3e3
+DETECTOR_RADIUS = 300.0
+DETECTOR_HALF_HEIGHT = 300.0
+BIPO_RADIUS = 200.0
+BIPO_HALF_HEIGHT = 200.0
+VERTEX_RESOLUTION = 30.0
+HITS_PER_MEV = 40.0
+
+
+def uniform_cylinder(rng, n, radius, half_height):
+    r = radius * np.sqrt(rng.random(n))
+    phi = rng.uniform(0, 2 * np.pi, n)
+    return r * np.cos(phi), r * np.sin(phi), rng.uniform(-half_height, half_height, n)
+
+
+def background_energy(rng, n):
+    # Falling continuum with a peak at 0.5 MeV for the Evis fit to find.
+    peak = rng.random(n) < 0.3
+    evis = rng.exponential(0.4, n)
+    evis[peak] = rng.normal(0.5, 0.05, peak.sum())
+    return np.clip(evis, 0.01, None)
+
+
+def generate_events(n_events, n_bipo=0, cluster_multiplicity=1.2, rate=100.0, muon_fraction=0.02, start_sec=1722500000, seed=0):
+    # Event-level truth: a time-ordered mix of background triggers and n_bipo injected Bi-Po pairs
+    # (both counted in n_events). Times are absolute, in ns.
+    rng = np.random.default_rng(seed)
+    n_bipo = min(n_bipo, n_events // 2)
+    n_background = n_events - 2 * n_bipo
+    duration = n_events / rate * 1e9
+
+    time = rng.uniform(0, duration, n_background)
+    x, y, z = uniform_cylinder(rng, n_background, DETECTOR_RADIUS, DETECTOR_HALF_HEIGHT)
+    evis = background_energy(rng, n_background)
+    muon = rng.random(n_background) < muon_fraction
+
+    prompt_time = rng.uniform(0, duration, n_bipo)
+    delay_time = prompt_time + rng.exponential(PO214_HALF_LIFE / np.log(2), n_bipo)
+    prompt_x, prompt_y, prompt_z = uniform_cylinder(rng, n_bipo, BIPO_RADIUS, BIPO_HALF_HEIGHT)
+    delay_x, delay_y, delay_z = (prompt_x + rng.normal(0, VERTEX_RESOLUTION, n_bipo), prompt_y + rng.normal(0, VERTEX_RESOLUTION, n_bipo),
+                                 prompt_z + rng.normal(0, VERTEX_RESOLUTION, n_bipo))
+    prompt_evis = 0.3 + 2.9 * rng.beta(2, 4, n_bipo)
+    delay_evis = rng.normal(0.95, 0.05, n_bipo)
+
+    events = {
+        'time': np.concatenate([time, prompt_time, delay_time]),
+        'x': np.concatenate([x, prompt_x, delay_x]),
+        'y': np.concatenate([y, prompt_y, delay_y]),
+        'z': np.concatenate([z, prompt_z, delay_z]),
+        'evis': np.concatenate([evis, prompt_evis, delay_evis]),
+        'muon': np.concatenate([muon, np.zeros(2 * n_bipo, dtype=bool)]),
+    }
+    order = np.argsort(events['time'], kind="stable")
+    events = {name: values[order] for name, values in events.items()}
+    events['time'] = events['time'].astype(np.int64) + np.int64(start_sec) * 1_000_000_000
+
+    # Time since the previous muon; events before the first muon are far from any.
+    muon_time = np.where(events['muon'], events['time'], np.iinfo(np.int64).min)
+    last_muon = np.maximum.accumulate(muon_time)
+    since_muon = np.where(last_muon == np.iinfo(np.int64).min, 1e12, (events['time'] - last_muon).astype(np.float64))
+    events['deltaTMuon'] = since_muon
+    events['deltaTLSMuon'] = since_muon
+
+    # Clusters: the first one carries the event vertex and time; extra ones share the charge.
+    n_clusters = 1 + rng.poisson(max(cluster_multiplicity - 1, 0), n_events)
+    n_clusters[rng.random(n_events) < 0.02] = 0
+    events['n_clusters'] = n_clusters
+    events['n_hits'] = np.minimum(rng.poisson(events['evis'] * HITS_PER_MEV), 4 * N_PMT)
+    return events
+
+
+def cluster_arrays(rng, events):
+    counts = events['n_clusters']
+    first = np.r_[0, np.cumsum(counts)[:-1]]
+    event_of_cluster = np.repeat(np.arange(len(counts)), counts)
+    is_first = np.zeros(counts.sum(), dtype=bool)
+    is_first[first[counts > 0]] = True
+
+    share = rng.random(counts.sum())
+    share /= np.bincount(event_of_cluster, weights=share, minlength=len(counts))[event_of_cluster]
+    charge = (events['evis'][event_of_cluster] * CHARGE_PER_MEV * share).astype(np.float32)
+    time = events['time'][event_of_cluster].astype(np.float64) + np.where(is_first, 0.0, rng.uniform(50, 500, counts.sum()))
+    vertex = {axis: np.where(is_first, events[axis.lower()][event_of_cluster], events[axis.lower()][event_of_cluster] + rng.normal(0, 100, counts.sum())).astype(np.float32)
+              for axis in "XYZ"}
+    return charge, time, vertex
+
+
+def write_raw_file(path, events, vertex="cbfRecVertex", seed=0):
+    # The cluster_reco/recoTree layout read by Read_Event_njulishuo; vertex is "cbfRecVertex" or "recPos".
+    rng = np.random.default_rng(seed + 1)
+    n_events = len(events['time'])
+    charge, time, position = cluster_arrays(rng, events)
+    pmt_id = rng.integers(0, N_PMT, events['n_hits'].sum()).astype(np.int32)
+
+    cluster_reco = {
+        'evtIDx': np.arange(n_events, dtype=np.int32),
+        'clusterCharge': ak.unflatten(charge, events['n_clusters']),
+        'recT': ak.unflatten(time, events['n_clusters']),
+        vertex: ak.zip({axis: ak.unflatten(position[axis], events['n_clusters']) for axis in "XYZ"}),
+    }
+    reco_tree = {
+        'evtIDx': np.arange(n_events, dtype=np.int32),
+        'n_sec': (events['time'] // 1_000_000_000).astype(np.int32),
+        'n_nsec': (events['time'] % 1_000_000_000).astype(np.int32),
+        'muonTag': events['muon'],
+        'deltaTLSMuon': events['deltaTLSMuon'],
+        'deltaTMuon': events['deltaTMuon'],
+        'IDhit_pmtId': ak.unflatten(pmt_id, events['n_hits']),
+    }
+
+    with uproot.recreate(path) as f:
+        f.mktree('cluster_reco', {'evtIDx': 'int32', 'clusterCharge': 'var * float32', 'recT': 'var * float64',
+                                  vertex: 'var * {X: float32, Y: float32, Z: float32}'},
+                 field_name=lambda outer, inner: f"{outer}/{outer}.fCoordinates.f{inner}", counter_name=lambda counted: f"n_{counted}")
+        f.mktree('recoTree', {'evtIDx': 'int32', 'n_sec': 'int32', 'n_nsec': 'int32', 'muonTag': 'bool',
+                              'deltaTLSMuon': 'float64', 'deltaTMuon': 'float64', 'IDhit_pmtId': 'var * int32'},
+                 counter_name=lambda counted: f"n_{counted}")
+        for start in range(0, n_events, BASKET_ENTRIES):
+            stop = start + BASKET_ENTRIES
+            f['cluster_reco'].extend({name: values[start:stop] for name, values in cluster_reco.items()})
+            f['recoTree'].extend({name: values[start:stop] for name, values in reco_tree.items()})
+    return path
+
+
+def generate_raw_file(path, n_events, n_bipo=0, cluster_multiplicity=1.2, vertex="cbfRecVertex", seed=0, **options):
+    events = generate_events(n_events, n_bipo, cluster_multiplicity, seed=seed, **options)
+    return write_raw_file(path, events, vertex, seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic OSIRIS raw ROOT files with injected Bi-Po pairs.")
+    parser.add_argument("output_folder")
+    parser.add_argument("--files", type=int, default=1)
+    parser.add_argument("--events", type=int, default=100000, help="triggers per file, Bi-Po events included")
+    parser.add_argument("--bipo", type=int, default=100, help="injected Bi-Po pairs per file")
+    parser.add_argument("--cluster-multiplicity", type=float, default=1.2, help="mean number of clusters per triggered event")
+    parser.add_argument("--rate", type=float, default=100.0, help="trigger rate in Hz, sets the file duration")
+    parser.add_argument("--vertex", choices=["cbfRecVertex", "recPos"], default="cbfRecVertex")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.output_folder, exist_ok=True)
+    start_sec = 1722500000
+    for i in range(args.files):
+        # Same name pattern as the real files, which the analysis parses for the start time.
+        start = time.strftime("%Y%m%d_%H%M%S", time.gmtime(start_sec))
+        name = f"OSIRISData_hybrid_{start}_OSIRIS_run-0_{start}_rs.root"
+        generate_raw_file(os.path.join(args.output_folder, name), args.events, args.bipo, args.cluster_multiplicity, args.vertex,
+                          args.seed + i, rate=args.rate, start_sec=start_sec)
+        start_sec += int(np.ceil(args.events / args.rate)) + 1
+        print(f"Written {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import logging
+import os
+import time
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import pandas as pd
+
+import Read_Event_njulishuo
+from BiPo214_evolution import (DEFAULT_CUTS, add_counts, bin_counts_from_arrays, bin_counts_to_arrays, count_pairs, file_start_time, load_candidates, plot_event_rate_evolution,
+                               log_error_file, rates_per_bin, record_candidates, tail_prompts, write_csv_atomic)
+from column_cache import write_atomic
+from Evis_plot import HistogramAccumulator
+from run_catalog import catalog_path, connect
+from run_metrics import FileMetrics, LOG_LEVELS, configure_logging
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "watch_state.npz"
+EVIS_HIST_FILE = "Evis_hist.npz"
+RATES_FILE = "event_rate_per_bin.csv"
+PLOT_FILE = "event_rate_evolution.png"
+ERROR_FILE = "watch_errors.txt"
+
+
+class WatchState:
+    # Running Bi-Po counts per time bin, the prompts that can still pair with the next file and
+    # the merged Evis histogram, persisted after every file so a restart continues where it
+    # stopped instead of re-reading the history.
+    def __init__(self, state_dir, cuts=DEFAULT_CUTS, time_bin="1h", num_bins=500, x_min=0.0, x_max=3.0):
+        self.state_dir = state_dir
+        self.cuts = tuple(float(cut) for cut in cuts)
+        self.time_bin = time_bin
+        self.live_time, self.pair_count, self.off_count = {}, {}, {}
+        self.tail = None
+        self.files = []
+        self.failed = []
+        self.evis = HistogramAccumulator(num_bins, x_min, x_max)
+
+    def load(self):
+        path = os.path.join(self.state_dir, STATE_FILE)
+        if not os.path.exists(path):
+            return self
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        if tuple(arrays["cuts"].tolist()) != self.cuts or str(arrays["time_bin"]) != self.time_bin:
+            raise ValueError(f"{path} was built with cuts {arrays['cuts'].tolist()} and time bin {arrays['time_bin']}; remove it to start over with the new ones")
+        self.live_time, self.pair_count, self.off_count = bin_counts_from_arrays(arrays)
+        self.files = arrays["files"].tolist()
+        self.failed = arrays["failed"].tolist() if "failed" in arrays else []
+        tail = {name[len("tail_"):]: values for name, values in arrays.items() if name.startswith("tail_")}
+        if tail:
+            self.tail = pd.DataFrame(tail)
+        num_bins, x_min, x_max = arrays["evis_binning"]
+        self.evis = HistogramAccumulator(int(num_bins), float(x_min), float(x_max), arrays["evis_counts"])
+        return self
+
+    def save(self):
+        arrays = bin_counts_to_arrays(self.live_time, self.pair_count, self.off_count)
+        arrays.update(cuts=np.array(self.cuts), time_bin=np.array(self.time_bin), files=np.array(self.files, dtype=str), failed=np.array(self.failed, dtype=str),
+                      evis_counts=self.evis.counts, evis_binning=np.array([self.evis.num_bins, self.evis.x_min, self.evis.x_max]))
+        if self.tail is not None:
+            arrays.update({"tail_" + name: self.tail[name].to_numpy() for name in self.tail.columns})
+        # One file, replaced at once, so the counts never get ahead of the file list.
+        write_atomic(os.path.join(self.state_dir, STATE_FILE), lambda f: np.savez(f, **arrays))
+        # The merged histogram again, in the format Evis_plot.HistogramAccumulator.load reads.
+        write_atomic(os.path.join(self.state_dir, EVIS_HIST_FILE), self.evis.save)
+
+    def add_file(self, filepath):
+        # Same bookkeeping as stream_coincidences, one file at a time.
+        filename = os.path.basename(filepath)
+        metrics = FileMetrics(filename)
+        df, live_time, prompt_events, delay_events = load_candidates(filepath, self.time_bin, self.cuts, metrics)
+        record_candidates(metrics, df, prompt_events, delay_events)
+        if len(df):
+            # Everything is computed before the state changes, so a failing file leaves it as it was.
+            pair_count, off_count = {}, {}
+            prompt_events = count_pairs(prompt_events, delay_events, self.tail, self.cuts, pair_count, off_count, filename, metrics)
+            tail = tail_prompts(prompt_events, df['rec_time'].max(), self.cuts).reset_index(drop=True)
+            evis = HistogramAccumulator(self.evis.num_bins, self.evis.x_min, self.evis.x_max).fill(df['Evis'].to_numpy())
+            add_counts(self.live_time, live_time)
+            add_counts(self.pair_count, pair_count)
+            add_counts(self.off_count, off_count)
+            self.tail = tail
+            self.evis += evis
+        self.files.append(filename)
+        return metrics.record()
+
+    def add_failed(self, filename):
+        # Not retried on later polls or restarts; no prompts are carried across it.
+        self.failed.append(filename)
+        self.tail = None
+
+    def rates(self):
+        return rates_per_bin(self.live_time, self.pair_count, self.off_count)
+
+
+def settled_files(folder, previous, skipped):
+    # Raw files still being written change size or mtime between polls; a file is taken once
+    # it is unchanged across two polls. Returns the settled files and this poll's stats. The
+    # conversion order does not matter: update_state counts the results in start_ns order.
+    current = {}
+    for name in os.listdir(folder):
+        if name.endswith(".root") and name not in skipped:
+            stat = os.stat(os.path.join(folder, name))
+            current[name] = (stat.st_size, stat.st_mtime_ns)
+    settled = [name for name, stamp in current.items() if previous.get(name) == stamp]
+    return sorted(settled), current
+
+
+def refresh_outputs(state, rates_csv, plot_path):
+    rates = state.rates()
+    write_csv_atomic(rates, rates_csv)
+    if len(rates):
+        plot_event_rate_evolution(rates['time_bin'], rates['event_mBq_20m3'], rates['event_mBq_20m3_error'], plot_path)
+    return rates
+
+
+def update_state(state, output_folder):
+    # Files converted but not yet counted, also those converted by an earlier run that stopped
+    # before counting them. They are counted in time order for the carried-over prompts.
+    counted = set(state.files) | set(state.failed)
+    names = [Read_Event_njulishuo.processed_name(root_file) for root_file in Read_Event_njulishuo.read_processed_log(output_folder)]
+    start_times = {}
+    for name in names:
+        if name in counted:
+            continue
+        try:
+            start_times[name] = file_start_time(os.path.join(output_folder, name))
+        except Exception as e:
+            record_failed(state, name, f"cannot read the start time: {e}")
+            state.save()
+    pending = sorted(start_times, key=start_times.get)
+    for name in pending:
+        try:
+            record = state.add_file(os.path.join(output_folder, name))
+            logger.info(f"Counted {name} ({record['wall_seconds']:.1f} s)")
+        except Exception as e:
+            record_failed(state, name, e)
+        state.save()
+    return len(pending)
+
+
+def record_failed(state, name, error):
+    error_message = " ".join(str(error).split())
+    logger.error(f"Error processing file: {name}, Error: {error_message}")
+    log_error_file(os.path.join(state.state_dir, ERROR_FILE), name, error_message)
+    state.add_failed(name)
+
+
+def watch(input_folder, output_folder, state_dir=None, poll_seconds=2.0, once=False, tree_name1="cluster_reco", tree_name2="recoTree", step_size=None, calibration=None,
+          cuts=DEFAULT_CUTS, time_bin="1h", **output_options):
+    state_dir = state_dir or output_folder
+    os.makedirs(state_dir, exist_ok=True)
+    state = WatchState(state_dir, cuts, time_bin).load()
+    rates_csv = os.path.join(state_dir, RATES_FILE)
+    plot_path = os.path.join(state_dir, PLOT_FILE)
+    catalog = connect(catalog_path(output_folder))
+    skipped = set(Read_Event_njulishuo.read_processed_log(output_folder))
+    if update_state(state, output_folder):
+        refresh_outputs(state, rates_csv, plot_path)
+
+    previous = None
+    try:
+        while True:
+            first_poll = previous is None
+            settled, previous = settled_files(input_folder, previous or {}, skipped)
+            for root_file in settled:
+                task = Read_Event_njulishuo.conversion_task(root_file, input_folder, output_folder, tree_name1, tree_name2, step_size, calibration,
+                                                            output_options=output_options)
+                Read_Event_njulishuo.log_conversion(output_folder, catalog, task, Read_Event_njulishuo.convert_task(task))
+                # Failed files are logged once and not retried until the next start.
+                skipped.add(root_file)
+            if update_state(state, output_folder):
+                rates = refresh_outputs(state, rates_csv, plot_path)
+                logger.info("%s", rates.tail(3))
+            if once and not settled and not first_poll:
+                return state
+            time.sleep(poll_seconds)
+    finally:
+        catalog.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert raw files as they land and keep the Bi-Po rate and merged Evis histogram up to date.")
+    parser.add_argument("input_folder", help="raw data folder to watch")
+    parser.add_argument("output_folder", help="processed data folder")
+    parser.add_argument("--state-dir", default=None, help=f"where {STATE_FILE}, {EVIS_HIST_FILE}, {RATES_FILE} and {PLOT_FILE} go; the output folder by default")
+    parser.add_argument("--poll", type=float, default=2.0, help="seconds between directory scans")
+    parser.add_argument("--once", action="store_true", help="process the files already there, then exit")
+    parser.add_argument("--time-bin", default="1h")
+    parser.add_argument("--step-size", type=int, default=None, help="convert in chunks of this many entries to bound memory")
+    parser.add_argument("--calibration", default=None, help="Evis calibration table (CSV) from Evis_plot")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="INFO")
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    calibration = Read_Event_njulishuo.load_calibration(args.calibration) if args.calibration else None
+    watch(args.input_folder, args.output_folder, args.state_dir, args.poll, args.once, step_size=args.step_size, calibration=calibration, time_bin=args.time_bin)
+
+
+if __name__ == "__main__":
+    main()